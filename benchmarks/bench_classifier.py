@@ -0,0 +1,168 @@
+"""
+消息分类器微基准
+
+用一批模拟的群聊消息对比：
+  legacy   - 旧的处理流程，照抄改动前的 handle_bilibili 和 utils（每条消息都用 re.search 字符串正则，
+             误识别检测 + 专栏检测 + is_bilibili_content + extract_bv_from_url）
+  classify - classifier.classify_links（子串预筛 + 单次取出全部链接，与 handle_bilibili 相同）
+并统计 Rule 预筛放行比例
+旧流程遇到 b23.tv 短链时会在事件循环中同步发起 requests.head，基准中不联网，只统计次数，不计入耗时，
+因此加速比只反映分类本身的CPU开销
+
+运行: python benchmarks/bench_classifier.py [消息数量]
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nonebot
+
+nonebot.init(driver='~none')
+
+from bilibili_upload.plugins.bilibili_upload.classifier import classify_links, might_contain_bilibili
+
+CHATTER = [
+    '今天吃什么',
+    '哈哈哈哈哈哈哈',
+    '有没有人打游戏',
+    '[CQ:face,id=178]',
+    '[CQ:image,file=abc123.image,url=https://gchat.qpic.cn/gchatpic_new/0/0-0-ABC/0]',
+    '明天几点开会？记得带电脑',
+    'ok',
+    '这个作业第三题怎么做啊，我算出来和答案不一样',
+    '@群主 改下群名片',
+    '草',
+    '晚安各位',
+    '[CQ:reply,id=123456][CQ:at,qq=10001] 收到',
+    'https://github.com/nonebot/nonebot2 这个框架挺好用',
+    '我觉得BVB那场踢得不错',
+]
+
+BILIBILI = [
+    '快看这个 https://www.bilibili.com/video/BV1kytazSEHE',
+    '【视频】https://b23.tv/1vfL3RX',
+    'BV1kytazSEHE',
+    '推荐 BV1GJ411x7h7 好看',
+    'https://m.bilibili.com/video/BV1xx411c7mD?p=2',
+    '专栏 https://www.bilibili.com/opus/912345678901234567',
+    'https://t.bilibili.com/912345678901234567 动态',
+]
+
+def build_corpus(size: int, bilibili_ratio: float = 0.03):
+    rng = random.Random(42)
+    return [
+        rng.choice(BILIBILI) if rng.random() < bilibili_ratio else rng.choice(CHATTER)
+        for _ in range(size)
+    ]
+
+# ---- 以下照抄改动前的 utils.py，只把短链解析换成计数 ----
+
+legacy_short_url_requests = 0
+
+def legacy_resolve_short_url(url: str) -> str:
+    # 原实现为同步的 requests.head(url, allow_redirects=True, timeout=10)，这里假定解析到视频页
+    global legacy_short_url_requests
+    legacy_short_url_requests += 1
+    return 'https://www.bilibili.com/video/BV1kytazSEHE'
+
+def legacy_extract_bv_from_url(text: str):
+    url_patterns = [
+        r'https?://www\.bilibili\.com/video/[a-zA-Z0-9?&=]+',
+        r'https?://b23\.tv/[a-zA-Z0-9]+',
+        r'https?://m\.bilibili\.com/video/[a-zA-Z0-9?&=]+',
+        r'https?://bilibili\.com/video/[a-zA-Z0-9?&=]+',
+    ]
+
+    for pattern in url_patterns:
+        match = re.search(pattern, text)
+        if match:
+            url = match.group()
+            if 'b23.tv' in url:
+                resolved_url = legacy_resolve_short_url(url)
+                if 'bilibili.com/video/' in resolved_url:
+                    return resolved_url
+                else:
+                    continue
+            return url
+
+    bv_pattern = r'(?:^|[\s\[\]()（）【】<>《》""''`~!@#$%^&*+=|\\:;,.\?/])(BV[1-9A-NP-Za-km-z]{10})(?=[\s\[\]()（）【】<>《》""''`~!@#$%^&*+=|\\:;,.\?/]|$)'
+    bv_match = re.search(bv_pattern, text)
+    if bv_match:
+        bv_id = bv_match.group(1)
+        if legacy_is_valid_bv_id(bv_id):
+            return f"https://www.bilibili.com/video/{bv_id}"
+
+    return None
+
+def legacy_is_valid_bv_id(bv_id: str) -> bool:
+    if not bv_id.startswith('BV') or len(bv_id) != 12:
+        return False
+    valid_chars = set('123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz')
+    bv_content = bv_id[2:]
+    return all(char in valid_chars for char in bv_content)
+
+def legacy_extract_opus_from_url(text: str):
+    opus_patterns = [
+        r'https?://www\.bilibili\.com/opus/\d+',
+        r'https?://t\.bilibili\.com/\d+',
+    ]
+    for pattern in opus_patterns:
+        match = re.search(pattern, text)
+        if match:
+            return match.group()
+    return None
+
+def legacy_is_bilibili_content(text: str) -> bool:
+    if re.search(r'https?://(?:www\.|m\.)?bilibili\.com/', text) or \
+       re.search(r'https?://b23\.tv/', text) or \
+       re.search(r'https?://t\.bilibili\.com/', text):
+        return True
+    if legacy_extract_bv_from_url(text):
+        return True
+    if legacy_extract_opus_from_url(text):
+        return True
+    return False
+
+def legacy_is_likely_false_positive(text: str) -> bool:
+    if len(text.strip()) < 20 and re.search(r'[\[\]()（）【】<>《》""'']', text):
+        return True
+    special_char_count = len(re.findall(r'[^\w\s\u4e00-\u9fff]', text))
+    if special_char_count > len(text) * 0.3:
+        return True
+    return False
+
+def legacy(text: str):
+    # 改动前 handle_bilibili 中对每条消息执行的识别部分
+    if legacy_is_likely_false_positive(text):
+        return None
+    if any(pattern in text for pattern in ['bilibili.com/opus/', 't.bilibili.com/']):
+        url_match = re.search(r'https?://(?:www\.bilibili\.com/opus/|t\.bilibili\.com/)\d+', text)
+        if url_match:
+            return url_match.group()
+    if not legacy_is_bilibili_content(text):
+        return None
+    return legacy_extract_bv_from_url(text)
+
+def bench(name: str, func, corpus):
+    start = time.perf_counter()
+    matched = sum(1 for text in corpus if func(text))
+    elapsed = time.perf_counter() - start
+    print(f'{name:<10} {elapsed * 1000:8.1f} ms  {elapsed / len(corpus) * 1e6:6.2f} us/msg  命中 {matched}')
+    return elapsed
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    corpus = build_corpus(size)
+    passed = sum(1 for text in corpus if might_contain_bilibili(text))
+    print(f'消息数 {size}，Rule 预筛放行 {passed} ({passed / size:.1%})')
+    legacy_time = bench('legacy', legacy, corpus)
+    classify_time = bench('classify', classify_links, corpus)
+    print(f'legacy 另有 {legacy_short_url_requests} 次同步 b23.tv 请求未计入耗时（每次会阻塞事件循环直到返回）')
+    print(f'分类CPU开销加速比 {legacy_time / classify_time:.1f}x')
+
+if __name__ == '__main__':
+    main()
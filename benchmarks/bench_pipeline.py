@@ -0,0 +1,237 @@
+"""
+下载/截图/消息分类的离线端到端基准
+
+启动本地B站替身服务器（mock_bilibili.py），把插件的HTTP客户端指向它，然后并发执行：
+  classify - classifier.classify_links 处理模拟群聊消息
+  video    - download_bilibili_video（接口/网页解析、镜像测速、分段下载、ffmpeg合并），部分链接走 b23.tv 短链
+  opus     - convert_opus_to_image（直接排版或浏览器截图，取决于已安装的依赖）
+输出各项吞吐量、p50/p95/最大延迟、进程峰值内存以及插件自身的分阶段统计
+
+运行: python benchmarks/bench_pipeline.py --videos 8 --concurrency 4 --bandwidth 4096 --latency 20
+依赖: ffmpeg（生成测试音视频并合并）；Pillow + 中文字体时专栏走直接排版
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import httpx
+import nonebot
+
+from mock_bilibili import LocalTransport, MockBilibili, generate_media
+
+BV_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='B站插件离线基准')
+    parser.add_argument('--videos', type=int, default=6, help='下载的视频数，0为跳过')
+    parser.add_argument('--opus', type=int, default=4, help='转换的专栏数，0为跳过')
+    parser.add_argument('--messages', type=int, default=100000, help='分类的消息数，0为跳过')
+    parser.add_argument('--concurrency', type=int, default=3, help='同时进行的视频/专栏任务数')
+    parser.add_argument('--duration', type=int, default=20, help='测试视频时长（秒）')
+    parser.add_argument('--bandwidth', type=int, default=0, help='CDN每连接带宽 KB/s，0为不限速')
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的首字节延迟（毫秒）')
+    parser.add_argument('--slow-mirror', action='store_true', help='让 baseUrl 所在镜像慢10倍，检验镜像选择')
+    parser.add_argument('--parts', type=int, default=1, help='每个视频的分P数，大于1时下载全部分P')
+    parser.add_argument('--short-ratio', type=float, default=0.5, help='视频链接中 b23.tv 短链的比例')
+    parser.add_argument('--no-api', action='store_true', help='关闭JSON接口，改为解析网页 __playinfo__')
+    parser.add_argument('--font', default='', help='直接排版专栏使用的字体路径，默认自动查找')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录')
+    return parser.parse_args()
+
+def percentile_line(name: str, samples, unit: str = 's', scale: float = 1.0) -> str:
+    from bilibili_upload.plugins.bilibili_upload.metrics import percentile
+    if not samples:
+        return f'{name:<10} 无样本'
+    return (f'{name:<10} n={len(samples):<6} p50 {percentile(samples, 50) * scale:8.3f}{unit}  '
+            f'p95 {percentile(samples, 95) * scale:8.3f}{unit}  max {max(samples) * scale:8.3f}{unit}')
+
+def peak_rss_mb(who: int) -> float:
+    # Linux 上 ru_maxrss 单位为KB，macOS 为字节
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+def random_bv(rng: random.Random) -> str:
+    return 'BV1' + ''.join(rng.choice(BV_ALPHABET) for _ in range(9))
+
+def use_mock_network(port: int):
+    """
+    所有域名组的客户端都经由 LocalTransport 发往替身服务器
+    """
+    from bilibili_upload.plugins.bilibili_upload import http_client
+
+    def create_client(group: str) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            headers=http_client.DEFAULT_HEADERS,
+            follow_redirects=True,
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            transport=LocalTransport(port, max_connections=http_client.plugin_config.bilibili_cdn_max_connections),
+        )
+
+    http_client._create_client = create_client
+
+def set_option(name: str, value):
+    """
+    各模块各自持有 Config 实例，基准参数需要逐个设置
+    """
+    for module in list(sys.modules.values()):
+        config = getattr(module, 'plugin_config', None)
+        if module and module.__name__.startswith('bilibili_upload.') and config is not None:
+            setattr(config, name, value)
+
+async def run_concurrent(items, concurrency: int, func):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies, results = [], []
+
+    async def run(item):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await func(item)
+            latencies.append(time.perf_counter() - started)
+            results.append(result)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(item) for item in items))
+    return time.perf_counter() - started, latencies, results
+
+def bench_classifier(count: int):
+    from bench_classifier import build_corpus
+    from bilibili_upload.plugins.bilibili_upload.classifier import classify_links
+
+    corpus = build_corpus(count)
+    latencies = []
+    started = time.perf_counter()
+    for text in corpus:
+        item_started = time.perf_counter()
+        classify_links(text)
+        latencies.append(time.perf_counter() - item_started)
+    elapsed = time.perf_counter() - started
+    print(f'classify   {count / elapsed:10.0f} msg/s')
+    print(percentile_line('classify', latencies, 'us', 1e6))
+
+async def bench_videos(args, rng: random.Random):
+    from bilibili_upload.plugins.bilibili_upload.bilibili_videos import download_bilibili_video, list_video_parts
+    from bilibili_upload.plugins.bilibili_upload.utils import resolve_short_url
+
+    urls = []
+    for _ in range(args.videos):
+        bv_id = random_bv(rng)
+        if rng.random() < args.short_ratio:
+            urls.append(f'https://b23.tv/{bv_id}')
+        else:
+            urls.append(f'https://www.bilibili.com/video/{bv_id}')
+
+    async def download(url: str):
+        # 与消息处理一致：先解析短链再展开分P，各分P并发下载
+        if 'b23.tv' in url:
+            url = await resolve_short_url(url)
+        size = 0
+        for success, message, path in await asyncio.gather(
+                *(download_bilibili_video(part_url, '') for part_url in await list_video_parts(url))):
+            if not success:
+                print(f'  失败: {url} {message}')
+            size += os.path.getsize(path) if success and path else 0
+        return size
+
+    elapsed, latencies, sizes = await run_concurrent(urls, args.concurrency, download)
+    total = sum(sizes)
+    ok = sum(1 for size in sizes if size)
+    print(f'video      成功 {ok}/{len(urls)}  输出 {total / 1024 / 1024:.1f}MB  '
+          f'{total / 1024 / 1024 / elapsed:.2f}MB/s  {ok / elapsed:.2f} 个/s')
+    print(percentile_line('video', latencies))
+
+async def bench_opus(args, rng: random.Random):
+    from bilibili_upload.plugins.bilibili_upload.bilibili_opus import convert_opus_to_image
+
+    urls = [f'https://www.bilibili.com/opus/{rng.randrange(10 ** 17, 10 ** 18)}' for _ in range(args.opus)]
+
+    async def convert(url: str):
+        success, message, path = await convert_opus_to_image(url, '')
+        if not success:
+            print(f'  失败: {url} {message}')
+        return success
+
+    elapsed, latencies, results = await run_concurrent(urls, args.concurrency, convert)
+    ok = sum(1 for result in results if result)
+    print(f'opus       成功 {ok}/{len(urls)}  {ok / elapsed:.2f} 个/s')
+    print(percentile_line('opus', latencies))
+
+async def main_async(args, mock: MockBilibili):
+    from bilibili_upload.plugins.bilibili_upload.browser_pool import PLAYWRIGHT_AVAILABLE, browser_pool
+    from bilibili_upload.plugins.bilibili_upload.http_client import close_clients
+    from bilibili_upload.plugins.bilibili_upload.cache import media_cache
+    from bilibili_upload.plugins.bilibili_upload.metrics import metrics
+
+    rng = random.Random(42)
+    try:
+        if args.videos:
+            await bench_videos(args, rng)
+        if args.opus:
+            await bench_opus(args, rng)
+    finally:
+        if PLAYWRIGHT_AVAILABLE:
+            await browser_pool.close()
+        await close_clients()
+        media_cache.close()
+
+    print(f'mock       请求 {mock.requests}  发送 {mock.bytes_sent / 1024 / 1024:.1f}MB')
+    print(f'peak RSS   本进程 {peak_rss_mb(resource.RUSAGE_SELF):.1f}MB  '
+          f'子进程(ffmpeg等) {peak_rss_mb(resource.RUSAGE_CHILDREN):.1f}MB')
+    print('--- 插件分阶段统计 ---')
+    print(metrics.summary())
+
+def main():
+    args = parse_args()
+    work_dir = tempfile.mkdtemp(prefix='bili_bench_')
+    # 插件的默认下载目录是相对路径，切换工作目录后所有文件都落在临时目录中
+    os.chdir(work_dir)
+    nonebot.init(driver='~none')
+
+    mock = None
+    try:
+        video_path, audio_path = generate_media(work_dir, args.duration) if args.videos else (None, None)
+        video_data = open(video_path, 'rb').read() if video_path else b''
+        audio_data = open(audio_path, 'rb').read() if audio_path else b''
+        mock = MockBilibili(
+            video_data, audio_data, args.duration,
+            bandwidth=args.bandwidth * 1024,
+            latency=args.latency / 1000,
+            slow_hosts=('upos-mock-a',) if args.slow_mirror else (),
+            parts=args.parts,
+        )
+        port = mock.start()
+        print(f'替身服务器 127.0.0.1:{port}  工作目录 {work_dir}')
+
+        import bilibili_upload.plugins.bilibili_upload.bilibili_videos  # noqa: F401
+        import bilibili_upload.plugins.bilibili_upload.bilibili_opus  # noqa: F401
+        use_mock_network(port)
+        if args.parts > 1:
+            set_option('bilibili_all_parts', True)
+        if args.no_api:
+            set_option('bilibili_use_api', False)
+        if args.font:
+            from bilibili_upload.plugins.bilibili_upload import opus_renderer
+            opus_renderer.FONT_PATH = args.font
+            opus_renderer.RENDERER_AVAILABLE = opus_renderer.PIL_AVAILABLE
+
+        if args.messages:
+            bench_classifier(args.messages)
+        asyncio.run(main_async(args, mock))
+    finally:
+        if mock:
+            mock.stop()
+        os.chdir(BENCH_DIR)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+本地的B站替身服务器，供基准测试离线使用
+
+提供：
+  api.bilibili.com   /x/web-interface/view、/x/player/playurl、/x/polymer/web-dynamic/v1/detail
+  www.bilibili.com   /video/BV...（含 window.__playinfo__）、/opus/...（静态专栏页）
+  b23.tv             /xxx -> 302 到视频页
+  *.bilivideo.com    DASH 音视频，支持 Range，可限制每连接带宽并增加首字节延迟
+  i0.hdslb.com       专栏图片和头像
+
+插件里的请求地址仍是真实域名，由 LocalTransport 改写到本服务器，原域名放在 X-Mock-Host 请求头中
+"""
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+MOCK_HOST_HEADER = 'X-Mock-Host'
+# 每次写入的块大小，限速按块计算
+WRITE_CHUNK = 16 * 1024
+
+def generate_media(directory: str, duration: int):
+    """
+    用ffmpeg生成可合并的H.264视频和AAC音频，返回 (视频路径, 音频路径)
+    """
+    if not shutil.which('ffmpeg'):
+        raise RuntimeError('需要ffmpeg来生成测试音视频')
+    video_path = os.path.join(directory, 'video.mp4')
+    audio_path = os.path.join(directory, 'audio.mp4')
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f'testsrc=size=1280x720:rate=30:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', '2M', '-an', '-y', video_path
+    ], check=True)
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:a', 'aac', '-b:a', '128k', '-vn', '-y', audio_path
+    ], check=True)
+    return video_path, audio_path
+
+def generate_picture(width: int = 1600, height: int = 900) -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        return b''
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (251, 114, 153)).save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+class MockBilibili:
+    def __init__(self, video_data: bytes, audio_data: bytes, duration: int,
+                 bandwidth: int = 0, latency: float = 0.0, slow_hosts=(), slow_factor: int = 10,
+                 opus_pictures: int = 3, parts: int = 1):
+        # bandwidth 为每个连接的字节/秒，0为不限速；latency 为首字节前的延迟秒数
+        self.video_data = video_data
+        self.audio_data = audio_data
+        self.duration = duration
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.slow_hosts = set(slow_hosts)
+        self.slow_factor = slow_factor
+        self.opus_pictures = opus_pictures
+        # 每个视频的分P数
+        self.parts = parts
+        self.picture = generate_picture()
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    # ---------- 数据 ----------
+
+    def _cid(self, bv_id: str) -> int:
+        return sum(ord(char) for char in bv_id) * 1000
+
+    def playinfo(self, bv_id: str) -> dict:
+        def item(media_type: str, item_id: int, bandwidth: int, codecs: str) -> dict:
+            path = f'/upgcxcode/{bv_id}/{media_type}-{item_id}.m4s?deadline=0'
+            return {
+                'id': item_id,
+                'baseUrl': 'https://upos-mock-a.bilivideo.com' + path,
+                'backupUrl': ['https://upos-mock-b.bilivideo.com' + path],
+                'bandwidth': bandwidth,
+                'codecs': codecs,
+            }
+        video_bandwidth = len(self.video_data) * 8 // max(1, self.duration)
+        audio_bandwidth = len(self.audio_data) * 8 // max(1, self.duration)
+        return {'data': {
+            'dash': {
+                'duration': self.duration,
+                'video': [item('video', 80, video_bandwidth, 'avc1.640032')],
+                'audio': [item('audio', 30280, audio_bandwidth, 'mp4a.40.2')],
+            }
+        }}
+
+    def opus_item(self, opus_id: str) -> dict:
+        text = '这是一条用于基准测试的专栏正文。' * 20
+        return {
+            'id_str': opus_id,
+            'modules': {
+                'module_author': {
+                    'name': '测试UP主',
+                    'face': 'https://i0.hdslb.com/bfs/face/mock.jpg',
+                    'pub_time': '2024年01月01日 12:00',
+                },
+                'module_dynamic': {'major': {'type': 'MAJOR_TYPE_OPUS', 'opus': {
+                    'title': f'基准测试专栏 {opus_id}',
+                    'summary': {'text': text, 'rich_text_nodes': [
+                        {'type': 'RICH_TEXT_NODE_TYPE_TEXT', 'text': text},
+                        {'type': 'RICH_TEXT_NODE_TYPE_TOPIC', 'text': '#基准测试#'},
+                    ]},
+                    'pics': [
+                        {'url': f'https://i0.hdslb.com/bfs/new_dyn/{opus_id}_{index}.jpg',
+                         'width': 1600, 'height': 900}
+                        for index in range(self.opus_pictures)
+                    ],
+                }}},
+            },
+        }
+
+    # ---------- 服务 ----------
+
+    def start(self) -> int:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.handle_request(head=True)
+
+            def do_GET(self):
+                self.handle_request(head=False)
+
+            def handle_request(self, head: bool):
+                with mock._lock:
+                    mock.requests += 1
+                if mock.latency:
+                    time.sleep(mock.latency)
+                host = self.headers.get(MOCK_HOST_HEADER) or self.headers.get('Host', '')
+                parsed = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                try:
+                    mock.route(self, host.split(':')[0], parsed.path, query, head)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def route(self, handler, host: str, path: str, query: dict, head: bool):
+        if host == 'api.bilibili.com':
+            if path == '/x/web-interface/view':
+                bv_id = query.get('bvid', '')
+                pages = [{'cid': self._cid(bv_id) + page, 'page': page, 'part': f'第{page}部分',
+                          'duration': self.duration} for page in range(1, self.parts + 1)]
+                data = {'title': f'基准测试视频 {bv_id}', 'cid': pages[0]['cid'],
+                        'duration': self.duration, 'pages': pages}
+                return self.send_json(handler, {'code': 0, 'data': data})
+            if path == '/x/player/playurl':
+                return self.send_json(handler, {'code': 0, **self.playinfo(query.get('bvid', ''))})
+            if path == '/x/polymer/web-dynamic/v1/detail':
+                return self.send_json(handler, {'code': 0, 'data': {'item': self.opus_item(query.get('id', ''))}})
+        elif host == 'b23.tv':
+            # 短链 b23.tv/<BV号> 直接跳到对应视频
+            return self.send(handler, 302, b'', headers={
+                'Location': f'https://www.bilibili.com/video/{path.strip("/")}'})
+        elif host.endswith('bilibili.com'):
+            match = re.match(r'/video/(BV\w{10})', path)
+            if match:
+                bv_id = match.group(1)
+                html = (
+                    f'<html><head><title>基准测试视频 {bv_id}</title></head><body>'
+                    f'<h1 title="基准测试视频 {bv_id}">基准测试视频 {bv_id}</h1>'
+                    f'<script>window.__playinfo__={json.dumps(self.playinfo(bv_id))}</script>'
+                    f'<script>window.__INITIAL_STATE__={{"cid":{self._cid(bv_id)}}}</script>'
+                    '</body></html>'
+                )
+                return self.send(handler, 200, html.encode(), 'text/html; charset=utf-8', head=head)
+            match = re.match(r'/opus/(\d+)', path)
+            if match:
+                item = self.opus_item(match.group(1))
+                opus = item['modules']['module_dynamic']['major']['opus']
+                pictures = ''.join(f'<img src="{pic["url"]}" width="100%">' for pic in opus['pics'])
+                html = (
+                    f'<html><head><title>{opus["title"]} - 哔哩哔哩</title></head><body>'
+                    f'<div class="opus-detail"><span class="up-name">测试UP主</span>'
+                    f'<h1>{opus["title"]}</h1><p>{opus["summary"]["text"]}</p>{pictures}</div>'
+                    '</body></html>'
+                )
+                return self.send(handler, 200, html.encode(), 'text/html; charset=utf-8', head=head)
+        elif host.endswith('bilivideo.com'):
+            data = self.video_data if '/video-' in path else self.audio_data
+            return self.send_media(handler, host, data, head)
+        elif host.endswith('hdslb.com'):
+            return self.send(handler, 200, self.picture, 'image/jpeg', head=head)
+        return self.send(handler, 404, b'not found')
+
+    def send_json(self, handler, payload: dict):
+        self.send(handler, 200, json.dumps(payload, ensure_ascii=False).encode(), 'application/json')
+
+    def send(self, handler, status: int, body: bytes, content_type: str = 'text/plain',
+             headers: dict = None, head: bool = False, bandwidth: int = 0):
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        if head:
+            return
+        if not bandwidth:
+            handler.wfile.write(body)
+        else:
+            for offset in range(0, len(body), WRITE_CHUNK):
+                started = time.monotonic()
+                chunk = body[offset:offset + WRITE_CHUNK]
+                handler.wfile.write(chunk)
+                delay = len(chunk) / bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        with self._lock:
+            self.bytes_sent += len(body)
+
+    def send_media(self, handler, host: str, data: bytes, head: bool):
+        bandwidth = self.bandwidth
+        if host.split('.')[0] in self.slow_hosts:
+            bandwidth = max(1, (bandwidth or 50 * 1024 * 1024) // self.slow_factor)
+        range_header = handler.headers.get('Range')
+        if range_header:
+            match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            return self.send(handler, 206, data[start:end + 1], 'video/mp4', headers={
+                'Content-Range': f'bytes {start}-{end}/{len(data)}', 'Accept-Ranges': 'bytes',
+            }, head=head, bandwidth=bandwidth)
+        return self.send(handler, 200, data, 'video/mp4', headers={'Accept-Ranges': 'bytes'},
+                         head=head, bandwidth=bandwidth)
+
+class LocalTransport(httpx.AsyncBaseTransport):
+    """
+    把发往任意域名的请求改写到本地替身服务器，原域名放进 X-Mock-Host
+    """
+
+    def __init__(self, port: int, max_connections: int = 100):
+        self.port = port
+        self._inner = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # 另建请求发往本地，原请求不变，响应的 url 仍是真实地址（短链解析依赖它）
+        headers = httpx.Headers(request.headers)
+        headers[MOCK_HOST_HEADER] = request.url.host
+        local = httpx.Request(
+            request.method,
+            request.url.copy_with(scheme='http', host='127.0.0.1', port=self.port),
+            headers=headers,
+            stream=request.stream,
+            extensions=request.extensions,
+        )
+        return await self._inner.handle_async_request(local)
+
+    async def aclose(self):
+        await self._inner.aclose()
@@ -1,17 +1,32 @@
 import asyncio
 import os
-import re
-import httpx
 import time
-from pathlib import Path
-from nonebot import on_message
+from typing import List, Optional, Tuple
+from nonebot import get_driver, on_command, on_message
+from nonebot.drivers import URL, ASGIMixin, HTTPServerSetup, Request, Response
+from nonebot.permission import SUPERUSER
+from nonebot.rule import Rule
 from nonebot.plugin import PluginMetadata
-from nonebot.adapters.onebot.v11 import Bot, MessageEvent, MessageSegment
+from nonebot.adapters.onebot.v11 import Bot, Message, MessageEvent, MessageSegment
+from nonebot.adapters.onebot.v11.exception import ActionFailed
 from nonebot.log import logger
 from .config import Config
-from .utils import is_bilibili_content, extract_bv_from_url, is_likely_false_positive
-from .bilibili_videos import download_bilibili_video
+from .utils import extract_bv_id, extract_page, resolve_short_url
+from .classifier import LINK_OPUS, LINK_SHORT, BilibiliLink, bilibili_rule, classify_links
+from .bilibili_videos import clean_filename, download_bilibili_video, list_video_parts
 from .bilibili_opus import convert_opus_to_image
+from .scheduler import JobRejected, video_scheduler
+from .singleflight import video_flight, opus_flight
+from .cache import media_cache
+from .browser_pool import PLAYWRIGHT_AVAILABLE, browser_pool
+from .http_client import close_clients
+from .short_url import canonicalize_video_url, short_url_resolver
+from .downloader import cleanup_stale_parts
+from .image_output import list_images
+from .backends import screenshot_backends
+from .metrics import metrics
+from .loading_images import loading_images
+from .delivery import cached_file_id, file_ids, file_server, media_segment, send_media, upload_file
 
 __plugin_meta__ = PluginMetadata(
     name="bilibili_upload",
@@ -22,111 +37,304 @@ __plugin_meta__ = PluginMetadata(
 
 plugin_config = Config()
 
-bilibili_matcher = on_message(priority=10, block=False)
+bilibili_matcher = on_message(rule=Rule(bilibili_rule), priority=10, block=False)
+stats_matcher = on_command("bili_stats", permission=SUPERUSER, priority=5, block=True)
+
+driver = get_driver()
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(200, headers={'Content-Type': 'text/plain; version=0.0.4'},
+                    content=metrics.render_prometheus())
+
+# 驱动自带HTTP服务时开放 Prometheus 抓取地址
+if plugin_config.bilibili_metrics_path and isinstance(driver, ASGIMixin):
+    driver.setup_http_server(HTTPServerSetup(
+        URL(plugin_config.bilibili_metrics_path), 'GET', 'bilibili_metrics', metrics_endpoint
+    ))
+
+@driver.on_startup
+async def cleanup_partial_downloads():
+    cleanup_stale_parts(plugin_config.bilibili_download_dir, plugin_config.bilibili_part_max_age)
+
+@driver.on_startup
+async def start_browser_pool():
+    # 提前启动浏览器，专栏截图时只需打开页面
+    if PLAYWRIGHT_AVAILABLE:
+        try:
+            await browser_pool.start()
+        except Exception as e:
+            logger.warning(f"浏览器预启动失败，将在首次截图时重试: {e}")
+
+@driver.on_startup
+async def start_loading_images():
+    loading_images.start()
+
+@driver.on_startup
+async def start_file_server():
+    # http 发送方式下由内置文件服务提供下载好的文件，OneBot按URL读取
+    if plugin_config.bilibili_delivery_mode == "http":
+        try:
+            await file_server.start()
+        except OSError as e:
+            logger.error(f"文件服务启动失败，发送时OneBot将无法读取文件: {e}")
+
+@driver.on_shutdown
+async def shutdown_plugin():
+    await video_scheduler.shutdown()
+    if PLAYWRIGHT_AVAILABLE:
+        await browser_pool.close()
+    screenshot_backends.shutdown()
+    await loading_images.close()
+    await file_server.close()
+    file_ids.save()
+    await close_clients()
+    media_cache.close()
+    short_url_resolver.save()
+
+async def send_forward(bot: Bot, event: MessageEvent, nickname: str, messages: List[Message]):
+    """
+    多条内容合并为一条转发消息发送
+    """
+    nodes = [MessageSegment.node_custom(int(bot.self_id), nickname, message) for message in messages]
+    group_id = getattr(event, 'group_id', None)
+    if group_id:
+        await bot.send_group_forward_msg(group_id=group_id, messages=nodes)
+    else:
+        await bot.send_private_forward_msg(user_id=event.user_id, messages=nodes)
+
+async def send_forward_images(bot: Bot, event: MessageEvent, text: str, image_paths):
+    messages = [Message(text)] + [Message(media_segment('image', path)) for path in image_paths]
+    await send_forward(bot, event, "B站专栏", messages)
+
+async def send_loading(bot: Bot, event: MessageEvent, text: str):
+    # 任务已提交，提示图片取自后台预先下载的图片池，不等待网络
+    loading_image = loading_images.pick()
+    try:
+        if loading_image:
+            await send_media(bot, event, text, 'image', loading_image)
+        else:
+            await bilibili_matcher.send(text)
+    except Exception as e:
+        logger.error(f"发送下载提示失败: {e}")
+
+def upload_name(path: str, suffix: str = '') -> str:
+    """
+    上传的文件以标题命名，查不到标题时用本地文件名
+    """
+    title = media_cache.title_of(path)
+    if not title:
+        return os.path.basename(path)
+    return f"{clean_filename(title)}{suffix}{os.path.splitext(path)[1]}"
+
+async def send_as_files(bot: Bot, event: MessageEvent, label: str, message: str,
+                        file_path: str, paths: List[str], file_size: int):
+    """
+    超过消息大小限制时改为上传群文件，接口不可用时只告知保存路径；切块的专栏图片逐张上传
+    """
+    uploaded = True
+    with metrics.stage('onebot_upload', kind='file'):
+        for path in paths:
+            suffix = f"_{os.path.splitext(os.path.basename(path))[0]}" if len(paths) > 1 else ''
+            if not await upload_file(bot, event, path, upload_name(path, suffix)):
+                uploaded = False
+                break
+    if uploaded:
+        await bilibili_matcher.send(
+            f"{label}: {message}\n文件较大({file_size / 1024 / 1024:.1f}MB)，已上传为文件"
+        )
+    else:
+        await bilibili_matcher.send(
+            f"{label}，但文件过大({file_size / 1024 / 1024:.1f}MB)，无法发送到群聊\n"
+            f"文件保存在: {file_path}"
+        )
+
+def submit_video(url: str, event: MessageEvent):
+    """
+    提交下载任务，同一视频的同一分P同时只下载一次，后来的请求等待同一个任务的结果
+    返回 (future, 是否新建任务, 排队位置)，被拒绝时抛出 JobRejected
+    """
+    position = 0
+
+    def start_job():
+        nonlocal position
+        future, position = video_scheduler.submit(
+            download_bilibili_video,
+            url,
+            plugin_config.bilibili_download_dir,
+            group_id=getattr(event, 'group_id', None),
+            user_id=event.user_id,
+        )
+        return future
+
+    bv_id = extract_bv_id(url)
+    job_future, is_leader = video_flight.join(f"{bv_id}:{extract_page(url)}" if bv_id else url, start_job)
+    return job_future, is_leader, position
+
+async def collect_video_urls(links: List[BilibiliLink]) -> List[str]:
+    """
+    并发解析全部短链，按需展开多P视频，去重后最多保留 bilibili_batch_max_videos 个
+    """
+    links = [link for link in links if link.kind != LINK_OPUS][:plugin_config.bilibili_batch_max_videos]
+
+    async def resolve(link) -> Optional[str]:
+        if link.kind != LINK_SHORT:
+            return link.url
+        url = await resolve_short_url(link.url)
+        return url if 'bilibili.com/video/' in url else None
+
+    resolved = await asyncio.gather(*(resolve(link) for link in links))
+    resolved = [canonicalize_video_url(url) for url in resolved if url]
+    parts = await asyncio.gather(*(list_video_parts(url) for url in dict.fromkeys(resolved)))
+    urls = dict.fromkeys(url for group in parts for url in group)
+    return list(urls)[:plugin_config.bilibili_batch_max_videos]
+
+async def handle_video_batch(bot: Bot, event: MessageEvent, urls: List[str]):
+    """
+    多个视频/分P并发下载，全部完成后合并为一条转发消息；过大的视频单独上传为文件
+    """
+    # 同时占用的任务数不超过群/用户上限，后面的链接等前面的完成后再提交，而不是直接被拒绝
+    limits = [limit for limit in (plugin_config.bilibili_group_job_limit, plugin_config.bilibili_user_job_limit) if limit]
+    semaphore = asyncio.Semaphore(min(limits) if limits else len(urls))
+
+    async def fetch(url: str) -> Tuple[bool, str, Optional[str]]:
+        async with semaphore:
+            try:
+                job_future, _, _ = submit_video(url, event)
+                return await asyncio.shield(job_future)
+            except JobRejected as e:
+                return False, str(e), None
+            except Exception as e:
+                logger.error(f"B站视频下载出错: {e}")
+                return False, f"下载过程中出现错误: {str(e)}", None
+
+    await send_loading(bot, event, f"共{len(urls)}个视频，正在下载喵~")
+    results = await asyncio.gather(*(fetch(url) for url in urls))
+
+    videos, failed, oversized = [], [], []
+    for url, (success, message, file_path) in zip(urls, results):
+        if not success or not file_path:
+            failed.append(f"{extract_bv_id(url) or url} P{extract_page(url)}: {message}")
+            continue
+        file_size = os.path.getsize(file_path)
+        if file_size > plugin_config.bilibili_max_file_size:
+            oversized.append((message, file_path, file_size))
+        else:
+            videos.append((message, file_path))
+
+    summary = f"下载完成 {len(videos) + len(oversized)}/{len(urls)} 个视频喵~"
+    if failed:
+        summary += "\n失败:\n" + "\n".join(failed)
+
+    def build_messages(use_file_ids: bool) -> List[Message]:
+        return [Message(summary)] + [
+            Message(MessageSegment.text(f"{message}\n")) + media_segment(
+                'video', file_path, cached_file_id(file_path) if use_file_ids else None)
+            for message, file_path in videos
+        ]
+
+    try:
+        if videos:
+            with metrics.stage('onebot_upload', kind='batch'):
+                try:
+                    await send_forward(bot, event, "B站视频", build_messages(use_file_ids=True))
+                except ActionFailed:
+                    # 可能是缓存的文件ID失效，全部改用文件地址重发一次
+                    if not any(cached_file_id(file_path) for _, file_path in videos):
+                        raise
+                    for _, file_path in videos:
+                        file_ids.discard(file_path)
+                    await send_forward(bot, event, "B站视频", build_messages(use_file_ids=False))
+        else:
+            await bilibili_matcher.send(summary)
+        for message, file_path, file_size in oversized:
+            await send_as_files(bot, event, "下载完成", message, file_path, [file_path], file_size)
+    except Exception as e:
+        logger.error(f"发送B站视频出错: {e}")
+        await bilibili_matcher.send(f"发送过程中出现错误: {str(e)}")
+
+@stats_matcher.handle()
+async def handle_stats():
+    await stats_matcher.finish(metrics.summary())
 
 @bilibili_matcher.handle()
 async def handle_bilibili(bot: Bot, event: MessageEvent):
+    request_started = time.monotonic()
     message_text = str(event.get_message())
     
-    # 添加误识别检测
-    if is_likely_false_positive(message_text):
+    # 单次分类：误识别检测 + 全部专栏/视频/短链识别，专栏优先
+    links = classify_links(message_text)
+    if not links:
         return
     
-    # 专栏处理逻辑保持不变
-    if any(pattern in message_text for pattern in ['bilibili.com/opus/', 't.bilibili.com/']):
-        url_match = re.search(r'https?://(?:www\.bilibili\.com/opus/|t\.bilibili\.com/)\d+', message_text)
-        if url_match:
-            opus_url = url_match.group()
-            await bilibili_matcher.send("正在转换专栏喵~")
-            try:
-                success, message, file_path = await convert_opus_to_image(
-                    opus_url, 
-                    plugin_config.bilibili_download_dir
-                )
-                if success and file_path:
-                    file_size = os.path.getsize(file_path)
-                    if file_size > plugin_config.bilibili_max_file_size:
-                        await bilibili_matcher.send(
-                            f"专栏截图完成，但文件过大({file_size / 1024 / 1024:.1f}MB)，无法发送到群聊\n"
-                            f"文件保存在: {file_path}"
-                        )
-                    else:
-                        image_segment = MessageSegment.image(Path(file_path))
-                        await bilibili_matcher.send(
-                            MessageSegment.text(f"完成了喵: {message}\n") + image_segment
-                        )
+    link = next((link for link in links if link.kind == LINK_OPUS), None)
+    if link is not None:
+        opus_url = link.url
+        await bilibili_matcher.send("正在转换专栏喵~")
+        try:
+            # 同一专栏同时只转换一次，重复请求共享结果
+            success, message, file_path = await opus_flight.do(
+                link.id,
+                lambda: convert_opus_to_image(opus_url, plugin_config.bilibili_download_dir)
+            )
+            if success and file_path:
+                # 长图切块后 file_path 为目录，每块单独检查大小
+                image_paths = list_images(file_path)
+                file_size = max(os.path.getsize(path) for path in image_paths)
+                if file_size > plugin_config.bilibili_max_file_size:
+                    await send_as_files(bot, event, "专栏截图完成", message, file_path, image_paths, file_size)
+                elif len(image_paths) > 1:
+                    with metrics.stage('onebot_upload', kind='opus'):
+                        await send_forward_images(bot, event, f"完成了喵: {message}", image_paths)
                 else:
-                    await bilibili_matcher.send(f"专栏转换失败: {message}")
-                    
-            except Exception as e:
-                logger.error(f"专栏转换出错: {e}")
-                await bilibili_matcher.send(f"专栏转换过程中出现错误: {str(e)}")
-            return
-    
-    # 检查是否为B站视频内容
-    if not is_bilibili_content(message_text):
+                    with metrics.stage('onebot_upload', kind='opus'):
+                        await send_media(bot, event, f"完成了喵: {message}\n", 'image', image_paths[0])
+            else:
+                await bilibili_matcher.send(f"专栏转换失败: {message}")
+            
+        except Exception as e:
+            logger.error(f"专栏转换出错: {e}")
+            await bilibili_matcher.send(f"专栏转换过程中出现错误: {str(e)}")
+        metrics.observe('bilibili_request_seconds', time.monotonic() - request_started, kind='opus')
         return
-        
-    url = extract_bv_from_url(message_text)
-    if not url:
+
+    # 一条消息中的多个链接或展开后的多个分P合并处理
+    urls = await collect_video_urls(links)
+    if not urls:
         return
-        
-    image_path = None
+    if len(urls) > 1:
+        await handle_video_batch(bot, event, urls)
+        metrics.observe('bilibili_request_seconds', time.monotonic() - request_started, kind='batch')
+        return
+    url = urls[0]
 
     try:
-        # 创建图片保存目录（如果不存在）
-        image_dir = os.path.join(plugin_config.bilibili_download_dir, "images")
-        os.makedirs(image_dir, exist_ok=True)
-
-        async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-            response = await client.get("https://t.alcy.cc/xhl")
-            if response.status_code == 200:
-                content_type = response.headers.get('content-type', '')
-                if 'webp' in content_type or response.url.path.endswith('.webp'):
-                    ext = '.webp'
-                # 生成唯一的文件名
-                timestamp = int(time.time())
-                image_path = os.path.join(image_dir, f"temp_image_{timestamp}{ext}")
-
-                # 保存图片到本地
-                with open(image_path, "wb") as f:
-                    f.write(response.content)
-
-                # 构建带图片的消息
-                image_segment = MessageSegment.image(Path(image_path))
-                message_with_image = MessageSegment.text("正在下载了喵~") + image_segment
-                await bilibili_matcher.send(message_with_image)
-            else:
-                logger.warning(f"获取图片失败，状态码: {response.status_code}, 最终URL: {response.url}")
-                await bilibili_matcher.send("正在下载了喵~")
-    except Exception as e:
-        logger.error(f"获取图片失败: {e}")
-        await bilibili_matcher.send("正在下载了喵~")
-    
+        job_future, is_leader, position = submit_video(url, event)
+    except JobRejected as e:
+        await bilibili_matcher.send(str(e))
+        return
+
+    if not is_leader:
+        loading_text = "相同视频正在下载中，完成后一起发送喵~"
+    elif position:
+        loading_text = f"排队中，当前第{position}位喵~"
+    else:
+        loading_text = "正在下载了喵~"
+    await send_loading(bot, event, loading_text)
+
     try:
-        loop = asyncio.get_event_loop()
-        success, message, file_path = await loop.run_in_executor(
-            None, 
-            download_bilibili_video, 
-            url, 
-            plugin_config.bilibili_download_dir
-        )
+        success, message, file_path = await asyncio.shield(job_future)
         
         if success and file_path:
             file_size = os.path.getsize(file_path)
             if file_size > plugin_config.bilibili_max_file_size:
-                await bilibili_matcher.send(
-                    f"下载完成，但文件过大({file_size / 1024 / 1024:.1f}MB)，无法发送到群聊\n"
-                    f"文件保存在: {file_path}"
-                )
+                await send_as_files(bot, event, "下载完成", message, file_path, [file_path], file_size)
             else:
-                video_segment = MessageSegment.video(Path(file_path))
-                await bilibili_matcher.send(
-                    MessageSegment.text(f"下载完成: {message}\n") + video_segment
-                )
+                with metrics.stage('onebot_upload', kind='video'):
+                    await send_media(bot, event, f"下载完成: {message}\n", 'video', file_path)
         else:
             await bilibili_matcher.send(f"下载失败: {message}")
             
     except Exception as e:
         logger.error(f"B站视频下载出错: {e}")
-        await bilibili_matcher.send(f"下载过程中出现错误: {str(e)}")
\ No newline at end of file
+        await bilibili_matcher.send(f"下载过程中出现错误: {str(e)}")
+    metrics.observe('bilibili_request_seconds', time.monotonic() - request_started, kind='video')
\ No newline at end of file
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional
+from nonebot.log import logger
+from .config import Config
+from .metrics import metrics
+
+plugin_config = Config()
+
+class CircuitBreaker:
+    """
+    截图方案连续失败 threshold 次后熔断，cooldown 秒内直接跳过；冷却结束后只放行一次试探，
+    试探结果返回前其他调用仍被跳过
+    """
+
+    def __init__(self, name: str, threshold: int, cooldown: float):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown and not self.trial_in_flight:
+            # 半开：允许一次试探，失败则重新计时
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def abandon(self):
+        # 试探没有得到结果（排队超时或被取消），下一个调用可以重新试探
+        self.trial_in_flight = False
+
+    def record(self, success: bool):
+        self.trial_in_flight = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.threshold and self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f'{self.name} 连续失败{self.failures}次，{self.cooldown:.0f}秒内不再使用')
+            self.opened_at = time.monotonic()
+
+class ScreenshotBackends:
+    """
+    管理各截图方案的熔断状态；Selenium/html2image 等阻塞方案各自使用专用的有界线程池并限时执行
+    一个方案卡住的线程不会占用其他方案的线程，限时从任务真正开始执行时计算
+    """
+
+    def __init__(self, workers: int, timeout: float, threshold: int, cooldown: float):
+        self.workers = workers
+        self.timeout = timeout
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        if name not in self._breakers:
+            self._breakers[name] = CircuitBreaker(name, self.threshold, self.cooldown)
+        return self._breakers[name]
+
+    async def _guard(self, name: str, awaitable: Awaitable[bool]) -> bool:
+        breaker = self.breaker(name)
+        started = time.monotonic()
+        try:
+            success = bool(await asyncio.wait_for(awaitable, self.timeout or None))
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except asyncio.TimeoutError:
+            logger.warning(f'{name} 截图超过{self.timeout:g}秒，已放弃')
+            success = False
+        except Exception as e:
+            logger.warning(f'{name} 截图出错: {e}')
+            success = False
+        breaker.record(success)
+        metrics.observe('bilibili_stage_seconds', time.monotonic() - started,
+                        stage='screenshot', backend=name, outcome='ok' if success else 'fail')
+        return success
+
+    async def run_async(self, name: str, func: Callable[..., Awaitable[bool]], *args) -> bool:
+        """
+        执行异步截图方案，熔断中直接返回False
+        """
+        if not self.breaker(name).allow():
+            metrics.inc('bilibili_breaker_skips_total', backend=name)
+            return False
+        return await self._guard(name, func(*args))
+
+    def _executor(self, name: str) -> ThreadPoolExecutor:
+        if name not in self._executors:
+            self._executors[name] = ThreadPoolExecutor(max_workers=max(1, self.workers),
+                                                       thread_name_prefix=f'bilibili_screenshot_{name}')
+        return self._executors[name]
+
+    async def run_blocking(self, name: str, func: Callable[..., bool], *args) -> bool:
+        """
+        在该方案专用的线程池中执行阻塞截图方案；超时后不再等待，线程池有界，卡住的任务不会无限堆积
+        排队超过限时仍未开始的任务直接放弃，不计入熔断
+        """
+        if not self.breaker(name).allow():
+            metrics.inc('bilibili_breaker_skips_total', backend=name)
+            return False
+        loop = asyncio.get_running_loop()
+        started = asyncio.Event()
+
+        def run() -> bool:
+            loop.call_soon_threadsafe(started.set)
+            return func(*args)
+
+        future = loop.run_in_executor(self._executor(name), run)
+        try:
+            await asyncio.wait_for(started.wait(), self.timeout or None)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self.breaker(name).abandon()
+            logger.warning(f'{name} 截图线程被之前的任务占用，排队超过{self.timeout:g}秒，已放弃')
+            metrics.inc('bilibili_screenshot_queue_timeouts_total', backend=name)
+            return False
+        return await self._guard(name, future)
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors.clear()
+
+screenshot_backends = ScreenshotBackends(
+    workers=plugin_config.bilibili_screenshot_workers,
+    timeout=plugin_config.bilibili_screenshot_timeout,
+    threshold=plugin_config.bilibili_breaker_threshold,
+    cooldown=plugin_config.bilibili_breaker_cooldown,
+)
@@ -0,0 +1,109 @@
+import httpx
+import time
+from typing import Dict, Optional, Tuple
+from .http_client import get_client
+from .singleflight import SingleFlight
+
+VIEW_API = 'https://api.bilibili.com/x/web-interface/view'
+PLAYURL_API = 'https://api.bilibili.com/x/player/playurl'
+DYNAMIC_DETAIL_API = 'https://api.bilibili.com/x/polymer/web-dynamic/v1/detail'
+
+# view 接口结果的缓存秒数，多P视频的各分P和链接刷新共用同一次请求
+VIEW_CACHE_TTL = 300
+
+class MetadataError(Exception):
+    """接口返回错误码或页面中找不到所需信息，异常信息可直接回复给用户"""
+
+class PageNotFound(MetadataError):
+    """请求的分P超出范围；网页中只有第1P的播放信息，不能改用网页解析"""
+
+class VideoInfo:
+    def __init__(self, bv_id: Optional[str], title: str, cid: Optional[int], duration: Optional[int],
+                 playinfo: dict, pages: Optional[list] = None):
+        self.bv_id = bv_id
+        self.title = title
+        self.cid = cid
+        self.duration = duration
+        # 与网页中 window.__playinfo__ 结构相同: {'data': {'dash': {...}}}
+        self.playinfo = playinfo
+        self.pages = pages or []
+
+async def get_api_json(url: str, params: dict) -> dict:
+    response = await get_client(url).get(url, params=params)
+    response.raise_for_status()
+    result = response.json()
+    if result.get('code') != 0:
+        raise MetadataError(f"接口返回错误: {result.get('code')} {result.get('message', '')}")
+    return result.get('data') or {}
+
+_view_cache: Dict[str, Tuple[dict, float]] = {}
+_view_flight = SingleFlight()
+
+async def fetch_video_view(bv_id: str) -> dict:
+    cached = _view_cache.get(bv_id)
+    now = time.monotonic()
+    if cached and cached[1] > now:
+        return cached[0]
+
+    async def _fetch():
+        view = await get_api_json(VIEW_API, {'bvid': bv_id})
+        for key in [key for key, (_, expires_at) in _view_cache.items() if expires_at <= now]:
+            del _view_cache[key]
+        _view_cache[bv_id] = (view, time.monotonic() + VIEW_CACHE_TTL)
+        return view
+
+    return await _view_flight.do(bv_id, _fetch)
+
+async def fetch_playurl(bv_id: str, cid: int) -> dict:
+    # fnval=4048 请求全部DASH格式
+    data = await get_api_json(PLAYURL_API, {'bvid': bv_id, 'cid': cid, 'fnval': 4048, 'fourk': 1})
+    if not data.get('dash'):
+        raise MetadataError("接口未返回DASH流")
+    return {'data': data}
+
+async def fetch_video_info(bv_id: str, page: int = 1) -> VideoInfo:
+    """
+    通过 view + playurl 两个接口获取标题、cid、时长和DASH流，不下载整个网页
+    多P视频取第 page P的cid和时长，标题后附上分P序号和分P名
+    """
+    view = await fetch_video_view(bv_id)
+    pages = view.get('pages') or []
+    title, cid, duration = view['title'], view['cid'], view.get('duration')
+    if page > 1 or len(pages) > 1:
+        part = next((item for item in pages if item.get('page') == page), None)
+        if part is None:
+            raise PageNotFound(f"视频没有第{page}P")
+        cid = part['cid']
+        duration = part.get('duration') or duration
+        title = f"{title} P{page} {part.get('part') or ''}".strip()
+    playinfo = await fetch_playurl(bv_id, cid)
+    return VideoInfo(
+        bv_id=bv_id,
+        title=title,
+        cid=cid,
+        duration=duration,
+        playinfo=playinfo,
+        pages=pages,
+    )
+
+async def fetch_opus_detail(opus_id: str) -> dict:
+    data = await get_api_json(DYNAMIC_DETAIL_API, {'id': opus_id, 'features': 'itemOpusStyle'})
+    if not data.get('item'):
+        raise MetadataError("接口未返回动态内容")
+    return data['item']
+
+def parse_opus_info(item: dict) -> Tuple[Optional[str], Optional[str]]:
+    """
+    从动态详情中取出 (标题, 作者)，没有标题时用正文开头代替
+    """
+    modules = item.get('modules') or {}
+    author = (modules.get('module_author') or {}).get('name')
+    major = (modules.get('module_dynamic') or {}).get('major') or {}
+    opus = major.get('opus') or {}
+    title = opus.get('title')
+    if not title:
+        summary = (opus.get('summary') or {}).get('text') or ''
+        title = summary.strip().split('\n')[0][:30] or None
+    return title, author
+
+API_ERRORS = (httpx.HTTPError, MetadataError, KeyError, TypeError, ValueError)
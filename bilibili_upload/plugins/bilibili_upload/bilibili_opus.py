@@ -1,20 +1,24 @@
 import os
 import re
-import requests
-import time
+import httpx
 import asyncio
 from typing import Optional, Tuple
 from pathlib import Path
+from nonebot.log import logger
 from .config import Config
+from .cache import media_cache
+from .utils import extract_opus_id
+from .http_client import get_client
+from .image_output import output_path_for, postprocess_screenshot
+from .opus_renderer import render_opus
+from .backends import screenshot_backends
+from .metrics import metrics
+from .bilibili_api import API_ERRORS, fetch_opus_detail, parse_opus_info
 
 plugin_config = Config()
 
-# 使用playwright
-try:
-    from playwright.async_api import async_playwright
-    PLAYWRIGHT_AVAILABLE = True
-except ImportError:
-    PLAYWRIGHT_AVAILABLE = False
+# 使用playwright，浏览器由常驻的 browser_pool 管理
+from .browser_pool import PLAYWRIGHT_AVAILABLE, browser_pool
 
 # 使用html2image
 try:
@@ -34,43 +38,63 @@ try:
 except ImportError:
     SELENIUM_AVAILABLE = False
 
+# 强制懒加载图片立即加载，按视口分批滚动并等待本批图片decode完成，
+# 内容就绪即返回，超过 timeoutMs 强制结束；返回实际等待的毫秒数
+WAIT_FOR_CONTENT_JS = """
+async (timeoutMs) => {
+    const start = performance.now();
+    const deadline = start + timeoutMs;
+    const root = document.querySelector('.opus-detail') || document.body;
+    const prime = () => {
+        const imgs = Array.from(root.querySelectorAll('img'));
+        for (const img of imgs) {
+            img.loading = 'eager';
+            const lazySrc = img.getAttribute('data-src');
+            if (lazySrc && img.getAttribute('src') !== lazySrc) {
+                img.src = lazySrc;
+            }
+        }
+        return imgs;
+    };
+    const settle = (img) => {
+        if (img.complete && img.naturalWidth > 0) return Promise.resolve();
+        return img.decode().catch(() => {});
+    };
+    const withDeadline = (promise) => Promise.race([
+        promise,
+        new Promise(resolve => setTimeout(resolve, Math.max(0, deadline - performance.now())))
+    ]);
+    const step = window.innerHeight || 800;
+    for (let y = 0; y < root.scrollHeight && performance.now() < deadline; y += step) {
+        window.scrollTo(0, y);
+        await new Promise(resolve => requestAnimationFrame(resolve));
+        await withDeadline(Promise.all(prime().map(settle)));
+    }
+    window.scrollTo(0, 0);
+    await withDeadline(Promise.all(prime().map(settle)));
+    return Math.round(performance.now() - start);
+}
+"""
+
 def clean_filename(filename):
     return re.sub(r'[<>:"/\\|?*]', '', filename)
 
-def get_opus_page(url: str) -> requests.Response:
+async def get_opus_page(url: str) -> httpx.Response:
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
         'Accept-Language': 'zh-CN,zh;q=0.8,zh-TW;q=0.7,zh-HK;q=0.5,en-US;q=0.3,en;q=0.2',
-        'Accept-Encoding': 'identity',
-        'Connection': 'keep-alive',
         'Upgrade-Insecure-Requests': '1',
         'Referer': 'https://www.bilibili.com/'
     }
     
-    response = requests.get(url, headers=headers, timeout=30, allow_redirects=True)
+    response = await get_client(url).get(url, headers=headers)
     response.raise_for_status()
     return response
 
 async def screenshot_opus_playwright(url: str, output_path: str) -> bool:
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    '--no-sandbox',
-                    '--disable-dev-shm-usage',
-                    '--disable-gpu',
-                    '--disable-web-security',
-                    '--disable-features=VizDisplayCompositor'
-                ]
-            )
-            
-            page = await browser.new_page(
-                viewport={'width': 1200, 'height': 800},
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            )
-            
+        async with browser_pool.page() as page:
             await page.goto(url, wait_until='networkidle', timeout=60000)
             await page.wait_for_selector('.opus-detail', timeout=20000)
             await page.add_style_tag(content="""
@@ -91,20 +115,10 @@ async def screenshot_opus_playwright(url: str, output_path: str) -> bool:
                 }
             """)
             
-            content_height = await page.evaluate('''() => {
-                const opus = document.querySelector('.opus-detail');
-                return opus ? opus.scrollHeight : document.body.scrollHeight;
-            }''')
-            
-            scroll_step = 800
-            current_position = 0
-            while current_position < content_height:
-                current_position += scroll_step
-                await page.evaluate(f'window.scrollTo(0, {current_position})')
-                await asyncio.sleep(0.5)
-                
-            await page.evaluate('window.scrollTo(0, 0)')
-            await asyncio.sleep(1)
+            timeout_ms = int(plugin_config.bilibili_screenshot_ready_timeout * 1000)
+            # goto 已等到 networkidle，这里只等正文图片解码完成
+            waited = await page.evaluate(WAIT_FOR_CONTENT_JS, timeout_ms)
+            logger.debug(f'专栏内容就绪，等待图片加载 {waited}ms')
             
             opus_element = await page.query_selector('.opus-detail')
             if opus_element:
@@ -121,10 +135,10 @@ async def screenshot_opus_playwright(url: str, output_path: str) -> bool:
                     timeout=60000
                 )
             
-            await browser.close()
             return True
             
     except Exception as e:
+        logger.warning(f'Playwright截图失败: {e}')
         return False
 
 def screenshot_opus_selenium(url: str, output_path: str) -> bool:
@@ -135,9 +149,13 @@ def screenshot_opus_selenium(url: str, output_path: str) -> bool:
         options.add_argument('--disable-dev-shm-usage')
         options.add_argument('--disable-gpu')
         options.add_argument('--window-size=1200,800')
+        if plugin_config.bilibili_opus_device_scale != 1:
+            options.add_argument(f'--force-device-scale-factor={plugin_config.bilibili_opus_device_scale}')
         options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
         
         driver = webdriver.Chrome(options=options)
+        # 页面加载卡住时让线程自行结束，不长期占用截图线程池
+        driver.set_page_load_timeout(60)
         
         try:
             driver.get(url)
@@ -167,20 +185,14 @@ def screenshot_opus_selenium(url: str, output_path: str) -> bool:
                 document.head.appendChild(style);
             """)
             
-            content_height = driver.execute_script('''
-                const opus = document.querySelector('.opus-detail');
-                return opus ? opus.scrollHeight : document.body.scrollHeight;
-            ''')
-            
-            scroll_step = 800
-            current_position = 0
-            while current_position < content_height:
-                current_position += scroll_step
-                driver.execute_script(f"window.scrollTo(0, {current_position});")
-                time.sleep(0.5)
-                
-            driver.execute_script("window.scrollTo(0, 0);")
-            time.sleep(1)
+            timeout = plugin_config.bilibili_screenshot_ready_timeout
+            driver.set_script_timeout(timeout + 5)
+            waited = driver.execute_async_script(
+                "const done = arguments[arguments.length - 1];"
+                f"({WAIT_FOR_CONTENT_JS})(arguments[0]).then(done, () => done(-1));",
+                int(timeout * 1000)
+            )
+            logger.debug(f'专栏内容就绪，等待图片加载 {waited}ms')
             
             try:
                 opus_element = driver.find_element(By.CLASS_NAME, "opus-detail")
@@ -197,10 +209,8 @@ def screenshot_opus_selenium(url: str, output_path: str) -> bool:
         print(f"Selenium截图失败: {e}")
         return False
 
-def screenshot_opus_html2image(url: str, output_path: str) -> bool:
+def screenshot_opus_html2image(html_content: str, output_path: str) -> bool:
     try:
-        response = get_opus_page(url)
-        html_content = response.text
         style_injection = """
         <style>
         .bili-header, .nav-bar, .fixed-sidenav-storage, .palette-button-wrap,
@@ -260,40 +270,99 @@ async def convert_opus_to_image(url: str, download_dir: str) -> Tuple[bool, str,
     try:
         if not os.path.exists(download_dir):
             os.makedirs(download_dir)
+
+        # 缓存命中时不再抓取页面
+        opus_id = extract_opus_id(url)
+        if opus_id:
+            cached = media_cache.lookup(opus_id)
+            if cached:
+                metrics.inc('bilibili_cache_hits_total', kind='opus')
+                return True, f"专栏图片已存在: {cached.title or opus_id}", cached.path
     
-        response = get_opus_page(url)
-        title, author = extract_opus_info(response.text)
+        title, author = None, None
+        opus_item = None
+        if opus_id and plugin_config.bilibili_use_api:
+            try:
+                with metrics.stage('opus_metadata', source='api'):
+                    opus_item = await fetch_opus_detail(opus_id)
+                title, author = parse_opus_info(opus_item)
+            except API_ERRORS as e:
+                logger.warning(f'接口获取专栏信息失败，改用网页解析: {e}')
+
+        # 网页只在接口失败或 html2image 兜底时才需要
+        html_content = None
+        if not title:
+            with metrics.stage('opus_metadata', source='page'):
+                html_content = (await get_opus_page(url)).text
+            title, author = extract_opus_info(html_content)
         if not title:
             return False, "无法提取专栏标题", None
         
         title = clean_filename(title)
         author_info = f"_{clean_filename(author)}" if author else ""
         
-        output_filename = f"opus_{title}{author_info}.png"
-        output_path = os.path.join(download_dir, output_filename)
+        # 有专栏id时按id命名，不受标题重名影响
+        output_base = os.path.join(download_dir, f"opus_{opus_id}" if opus_id else f"opus_{title}{author_info}")
+        # 浏览器先输出PNG，再按 bilibili_opus_format 压缩/切块
+        raw_path = output_base + '.png'
         
-        if os.path.exists(output_path):
+        output_path = output_path_for(output_base)
+        if output_path:
+            metrics.inc('bilibili_cache_hits_total', kind='opus')
+            if opus_id:
+                media_cache.put(f"opus:{opus_id}", opus_id, output_path, title)
             return True, f"专栏图片已存在: {title}", output_path
         
         if author:
             print(f'>>>作者: {author}')
+        metrics.inc('bilibili_cache_misses_total', kind='opus')
         screenshot_success = False
+        backend = None
         
+        # 接口数据足够时直接排版出图，不启动浏览器
+        if opus_item and plugin_config.bilibili_opus_renderer == 'auto':
+            with metrics.stage('screenshot', backend='renderer'):
+                screenshot_success = await render_opus(opus_item, raw_path)
+            backend = 'renderer'
+        
+        # 每个方案限时执行，连续失败的方案在冷却期内直接跳过
         if PLAYWRIGHT_AVAILABLE and not screenshot_success:
-            screenshot_success = await screenshot_opus_playwright(url, output_path)
+            screenshot_success = await screenshot_backends.run_async(
+                'playwright', screenshot_opus_playwright, url, raw_path)
+            backend = 'playwright'
         
+        # Selenium 和 html2image 是阻塞调用，放到专用线程池中执行
         if SELENIUM_AVAILABLE and not screenshot_success:
-            screenshot_success = screenshot_opus_selenium(url, output_path)
+            screenshot_success = await screenshot_backends.run_blocking(
+                'selenium', screenshot_opus_selenium, url, raw_path)
+            backend = 'selenium'
         
-        if HTML2IMAGE_AVAILABLE and not screenshot_success:
-            screenshot_success = screenshot_opus_html2image(url, output_path)
+        if HTML2IMAGE_AVAILABLE and not screenshot_success and screenshot_backends.breaker('html2image').allow():
+            if html_content is None:
+                try:
+                    html_content = (await get_opus_page(url)).text
+                except httpx.HTTPError as e:
+                    logger.warning(f'获取专栏网页失败: {e}')
+            if html_content is not None:
+                screenshot_success = await screenshot_backends.run_blocking(
+                    'html2image', screenshot_opus_html2image, html_content, raw_path)
+                backend = 'html2image'
         
-        if screenshot_success and os.path.exists(output_path):
+        if screenshot_success and os.path.exists(raw_path):
+            metrics.inc('bilibili_opus_backend_total', backend=backend)
+            try:
+                with metrics.stage('image_postprocess'):
+                    output_path = await asyncio.to_thread(postprocess_screenshot, raw_path, output_base)
+            except OSError as e:
+                logger.warning(f'截图压缩失败，发送原图: {e}')
+                output_path = raw_path
+            if opus_id:
+                media_cache.put(f"opus:{opus_id}", opus_id, output_path, title)
             return True, f" {title}", output_path
         else:
             return False, "所有截图方案都失败了，请检查依赖安装", None
             
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         return False, f"网络请求错误: {str(e)}", None
     except Exception as e:
         return False, f"未知错误: {str(e)}", None
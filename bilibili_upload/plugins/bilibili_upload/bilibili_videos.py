@@ -1,62 +1,226 @@
-import requests
+import asyncio
+import httpx
 import re
 import json
 import os
 import subprocess
-from typing import Optional, Tuple
+import time
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from nonebot.log import logger
 from .config import Config
+from .downloader import download_media_pair
+from .pipeline import http_merge, pipe_merge, pipeline_mode
+from .transcode import TRANSCODE_AUDIO_BITRATE, run_ffmpeg, transcode_args
+from .cache import media_cache
+from .http_client import get_client
+from .mirrors import candidate_urls, pick_mirrors, rank_by_score
+from .metrics import metrics
+from .scheduler import release_worker
+from .utils import extract_bv_id, extract_page, resolve_short_url, video_page_url
+from .bilibili_api import API_ERRORS, MetadataError, PageNotFound, VideoInfo, fetch_video_info, fetch_video_view
 
 plugin_config = Config()
 
+# 限制同时运行的ffmpeg进程数，与下载并发分开控制；等待中的任务被取消时不占用名额
+ffmpeg_semaphore = asyncio.Semaphore(max(1, plugin_config.bilibili_ffmpeg_workers))
+
 def clean_filename(filename):
     return re.sub(r'[<>:"/\\|?*]', '', filename)
 
-def get_bilibili_page(url: str) -> requests.Response:
+async def get_bilibili_page(url: str) -> httpx.Response:
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 Edg/91.0.864.67',
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
         'Accept-Language': 'zh-CN,zh;q=0.8,zh-TW;q=0.7,zh-HK;q=0.5,en-US;q=0.3,en;q=0.2',
-        'Accept-Encoding': 'identity',
-        'Connection': 'keep-alive',
         'Upgrade-Insecure-Requests': '1',
         'Referer': url
     }
     
     if 'b23.tv' in url:
-        try:
-            head_response = requests.head(url, headers=headers, allow_redirects=True, timeout=10)
-            url = head_response.url
-            print(f'>>>解析后的URL: {url}')
-        except Exception as e:
-            print(f'>>>短链接解析失败，尝试直接访问: {e}')
+        url = await resolve_short_url(url)
+        print(f'>>>解析后的URL: {url}')
     
-    response = requests.get(url, headers=headers, timeout=30, allow_redirects=True)
+    response = await get_client(url).get(url, headers=headers)
     response.raise_for_status()
     return response
 
-def merge_audio_video(video_path, audio_path, output_path):
+# 可直接封装进mp4并在QQ中正常播放的编码
+COPY_COMPATIBLE_VIDEO_CODECS = ('avc1', 'avc3', 'h264')
+COPY_COMPATIBLE_AUDIO_CODECS = ('mp4a', 'aac')
+
+def probe_codec(path: str) -> Optional[str]:
+    """
+    用ffprobe读取文件第一条流的编码名，ffprobe不可用时返回None
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', '0',
+        '-show_entries', 'stream=codec_name',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        path
+    ]
     try:
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-i', audio_path,
-            '-c:v', 'libx264',
-            '-preset', 'medium',
-            '-crf', '23',
-            '-c:a', 'aac',
-            '-b:a', '128k',
-            '-movflags', '+faststart',
-            '-y',
-            output_path
-        ]
-        
-        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return result.returncode == 0
-    
-    except FileNotFoundError:
-        raise Exception("未找到ffmpeg")
-    except Exception as e:
-        raise Exception(f"合并时错误：{str(e)}")
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=30)
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    codec = result.stdout.decode(errors='ignore').strip()
+    return codec or None
+
+def can_stream_copy(video_codecs: Optional[str], audio_codecs: Optional[str]) -> bool:
+    if not video_codecs or not audio_codecs:
+        return False
+    return video_codecs.lower().startswith(COPY_COMPATIBLE_VIDEO_CODECS) and \
+        audio_codecs.lower().startswith(COPY_COMPATIBLE_AUDIO_CODECS)
+
+def ffmpeg_codec_args(stream_copy: bool, video_bitrate: Optional[int] = None) -> List[str]:
+    if stream_copy:
+        return ['-c', 'copy']
+    # 指定码率时按目标码率转码，使输出文件不超过大小限制；否则按 bilibili_transcode_profile 的CRF
+    return transcode_args(video_bitrate)
+
+async def run_ffmpeg_merge(video_path, audio_path, output_path, stream_copy: bool,
+                           video_bitrate: Optional[int] = None, duration: Optional[float] = None) -> bool:
+    codec_args = ffmpeg_codec_args(stream_copy, video_bitrate)
+    args = [
+        '-i', video_path,
+        '-i', audio_path,
+        '-map', '0:v:0',
+        '-map', '1:a:0',
+        *codec_args,
+        '-movflags', '+faststart',
+        '-y',
+        output_path
+    ]
+    async with ffmpeg_semaphore:
+        return await run_ffmpeg(args, duration=duration)
+
+async def merge_audio_video(video_path, audio_path, output_path,
+                            video_codecs: Optional[str] = None, audio_codecs: Optional[str] = None,
+                            video_bitrate: Optional[int] = None, duration: Optional[float] = None) -> bool:
+    """
+    按 bilibili_merge_mode 合并音视频：
+    auto      - 编码为H.264+AAC时直接封装(-c copy)，否则或封装失败时转码
+    copy      - 总是直接封装，不转码
+    transcode - 总是用libx264/AAC重新编码
+    video_codecs/audio_codecs 取自 __playinfo__ 的 codecs 字段，缺失时用ffprobe探测
+    指定 video_bitrate 时忽略合并方式，按该码率转码
+    ffmpeg 以异步子进程运行，超时或任务取消时会被结束
+    """
+    if video_bitrate:
+        return await run_ffmpeg_merge(video_path, audio_path, output_path, stream_copy=False,
+                                      video_bitrate=video_bitrate, duration=duration)
+    mode = plugin_config.bilibili_merge_mode
+    if mode == 'transcode':
+        return await run_ffmpeg_merge(video_path, audio_path, output_path, stream_copy=False, duration=duration)
+    if mode == 'copy':
+        return await run_ffmpeg_merge(video_path, audio_path, output_path, stream_copy=True, duration=duration)
+
+    video_codecs = video_codecs or await asyncio.to_thread(probe_codec, video_path)
+    audio_codecs = audio_codecs or await asyncio.to_thread(probe_codec, audio_path)
+    if can_stream_copy(video_codecs, audio_codecs):
+        logger.debug(f'编码兼容({video_codecs}, {audio_codecs})，直接封装')
+        if await run_ffmpeg_merge(video_path, audio_path, output_path, stream_copy=True, duration=duration):
+            return True
+        logger.warning('直接封装失败，改为转码')
+    else:
+        logger.debug(f'编码不兼容({video_codecs}, {audio_codecs})，转码合并')
+    return await run_ffmpeg_merge(video_path, audio_path, output_path, stream_copy=False, duration=duration)
+
+async def pipelined_merge(mode: str, video_url: str, audio_url: str, headers: dict, output_path: str,
+                          video_codecs: Optional[str], audio_codecs: Optional[str],
+                          video_bitrate: Optional[int] = None,
+                          progress_callback: Optional[Callable[[str, int, Optional[int]], None]] = None,
+                          duration: Optional[float] = None) -> bool:
+    """
+    边下载边合并，不落临时文件；没有本地文件可供ffprobe，是否直接封装只看 codecs 字段
+    """
+    merge_mode = plugin_config.bilibili_merge_mode
+    if video_bitrate:
+        stream_copy = False
+    elif merge_mode in ('copy', 'transcode'):
+        stream_copy = merge_mode == 'copy'
+    else:
+        stream_copy = can_stream_copy(video_codecs, audio_codecs)
+    codec_args = ffmpeg_codec_args(stream_copy, video_bitrate)
+
+    async with ffmpeg_semaphore:
+        if mode == 'pipe':
+            return await pipe_merge(video_url, audio_url, headers, output_path, codec_args,
+                                    progress_callback=progress_callback, duration=duration)
+        return await http_merge(video_url, audio_url, headers, output_path, codec_args,
+                                progress_callback=progress_callback, duration=duration)
+
+# 封装格式带来的额外体积
+MUX_OVERHEAD = 1.02
+REENCODE_AUDIO_BITRATE = TRANSCODE_AUDIO_BITRATE
+MIN_REENCODE_VIDEO_BITRATE = 150 * 1000
+
+class StreamSelection:
+    def __init__(self, video_item: dict, audio_item: dict, estimated_size: Optional[int],
+                 fits: bool = True, video_bitrate: Optional[int] = None):
+        self.video_item = video_item
+        self.audio_item = audio_item
+        self.estimated_size = estimated_size
+        self.fits = fits
+        # 不为None时需要按该码率重新编码
+        self.video_bitrate = video_bitrate
+
+def estimate_size(video_item: dict, audio_item: dict, duration: Optional[float]) -> Optional[int]:
+    bandwidth = (video_item.get('bandwidth') or 0) + (audio_item.get('bandwidth') or 0)
+    if not bandwidth or not duration:
+        return None
+    return int(bandwidth * duration / 8 * MUX_OVERHEAD)
+
+def select_streams(json_data: dict, duration: Optional[float], max_size: int) -> Optional[StreamSelection]:
+    """
+    根据DASH中的 bandwidth 和时长估算合并后的大小，在下载前选出不超过 max_size 的最佳音视频组合
+    画质优先于音质，同画质下优先选择可直接封装的H.264
+    都超出时：开启 bilibili_reencode_to_fit 则选最小的组合并给出目标码率，否则返回 fits=False
+    缺少码率或时长信息时退回按索引选择
+    """
+    dash = json_data['data']['dash']
+    duration = duration or dash.get('duration')
+    videos = [item for item in dash.get('video') or [] if _media_item_url(item)]
+    audios = [item for item in dash.get('audio') or [] if _media_item_url(item)]
+    if not videos or not audios:
+        return None
+
+    estimable = duration and all(item.get('bandwidth') for item in videos + audios)
+    if plugin_config.bilibili_quality_select != 'size' or not estimable:
+        video_item = get_media_item(json_data, 'video')
+        audio_item = get_media_item(json_data, 'audio')
+        if not video_item or not audio_item:
+            return None
+        return StreamSelection(video_item, audio_item, estimate_size(video_item, audio_item, duration))
+
+    capped = [item for item in videos if item.get('id', 0) <= plugin_config.bilibili_max_quality]
+    videos = sorted(capped or videos, key=lambda item: (
+        item.get('id', 0),
+        (item.get('codecs') or '').lower().startswith(COPY_COMPATIBLE_VIDEO_CODECS),
+        item['bandwidth'],
+    ), reverse=True)
+    audios = sorted(audios, key=lambda item: item['bandwidth'], reverse=True)
+
+    for video_item in videos:
+        for audio_item in audios:
+            size = estimate_size(video_item, audio_item, duration)
+            if size <= max_size:
+                logger.debug(f"选择清晰度 {video_item.get('id')} ({video_item.get('codecs')})，预计 {size / 1024 / 1024:.1f}MB")
+                return StreamSelection(video_item, audio_item, size)
+
+    video_item = min(videos, key=lambda item: item['bandwidth'])
+    audio_item = min(audios, key=lambda item: item['bandwidth'])
+    size = estimate_size(video_item, audio_item, duration)
+    if plugin_config.bilibili_reencode_to_fit:
+        video_bitrate = int(max_size * 8 / duration / MUX_OVERHEAD * 0.95) - REENCODE_AUDIO_BITRATE
+        if video_bitrate >= MIN_REENCODE_VIDEO_BITRATE:
+            logger.warning(f'最低画质也超出大小限制，将按 {video_bitrate // 1000}kbps 重新编码')
+            return StreamSelection(video_item, audio_item, size, video_bitrate=video_bitrate)
+    return StreamSelection(video_item, audio_item, size, fits=False)
 
 def cleanup_temp_files(video_path, audio_path):
     try:
@@ -67,70 +231,201 @@ def cleanup_temp_files(video_path, audio_path):
     except Exception:
         pass
 
-def download_bilibili_video(url: str, download_dir: str) -> Tuple[bool, str, Optional[str]]:
+async def scrape_video_info(url: str, bv_id: Optional[str]) -> VideoInfo:
+    """
+    从视频网页中解析标题、cid和 __playinfo__，作为接口失败时的后备方案
+    """
+    resp = await get_bilibili_page(url)
+
+    title_match = re.findall('<h1.*?>(.*?)</h1>', resp.text)
+    if not title_match:
+        raise MetadataError("无法提取视频标题")
+    
+    json_match = re.findall('<script>window.__playinfo__=(.*?)</script>', resp.text)
+    if not json_match:
+        raise MetadataError("无法找到视频信息")
+
+    cid_match = re.search(r'"cid":(\d+)', resp.text)
+    # 带 ?p= 的页面中 __playinfo__ 即为该分P
+    page = extract_page(url)
+    title = title_match[0] if page == 1 else f"{title_match[0]} P{page}"
+    return VideoInfo(
+        bv_id=bv_id or extract_bv_id(str(resp.url)),
+        title=title,
+        cid=int(cid_match.group(1)) if cid_match else None,
+        duration=None,
+        playinfo=json.loads(json_match[0]),
+    )
+
+async def get_video_info(url: str, bv_id: Optional[str]) -> VideoInfo:
+    if bv_id and plugin_config.bilibili_use_api:
+        try:
+            return await fetch_video_info(bv_id, extract_page(url))
+        except PageNotFound:
+            raise
+        except API_ERRORS as e:
+            logger.warning(f'接口获取视频信息失败，改用网页解析: {e}')
+    return await scrape_video_info(url, bv_id)
+
+def make_url_refresher(url: str, bv_id: Optional[str], media_type: str, media_item: dict):
+    """
+    CDN签名链接过期时重新获取播放信息，返回同一清晰度、同一编码的新链接（含备用镜像）
+    """
+    async def refresh() -> Optional[List[str]]:
+        try:
+            info = await get_video_info(url, bv_id)
+        except (MetadataError, httpx.HTTPError, ValueError) as e:
+            logger.warning(f'刷新{media_type}流链接失败: {e}')
+            return None
+        for item in info.playinfo['data']['dash'].get(media_type) or []:
+            if item.get('id') == media_item.get('id') and item.get('codecs') == media_item.get('codecs'):
+                return rank_by_score(candidate_urls(item)) or None
+        return None
+    return refresh
+
+def part_source_id(bv_id: str, page: int) -> str:
+    # 第1P沿用BV号，与分P支持之前的缓存条目一致
+    return bv_id if page == 1 else f"{bv_id}_p{page}"
+
+async def list_video_parts(url: str) -> List[str]:
+    """
+    开启 bilibili_all_parts 且链接未指定 p= 时，把多P视频展开为各分P的链接，否则原样返回
+    """
+    bv_id = extract_bv_id(url)
+    if not plugin_config.bilibili_all_parts or not bv_id or 'p' in parse_qs(urlparse(url).query) or not plugin_config.bilibili_use_api:
+        return [url]
+    try:
+        view = await fetch_video_view(bv_id)
+    except API_ERRORS as e:
+        logger.warning(f'获取分P列表失败，只下载第1P: {e}')
+        return [url]
+    pages = [item.get('page') for item in view.get('pages') or [] if item.get('page')]
+    if len(pages) <= 1:
+        return [url]
+    return [video_page_url(bv_id, page) for page in pages]
+
+async def download_bilibili_video(url: str, download_dir: str,
+                                  progress_callback: Optional[Callable[[str, int, Optional[int]], None]] = None) -> Tuple[bool, str, Optional[str]]:
     download_dir = plugin_config.bilibili_download_dir
     try:
         if not os.path.exists(download_dir):
             os.makedirs(download_dir)
 
+        # 缓存命中时不再抓取页面
+        bv_id = extract_bv_id(url)
+        page = extract_page(url)
+        if bv_id:
+            cached = media_cache.lookup(part_source_id(bv_id, page))
+            if cached:
+                metrics.inc('bilibili_cache_hits_total', kind='video')
+                return True, f"视频已存在: {cached.title or bv_id}", cached.path
+
         head = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 Edg/91.0.864.67',
             'Referer': url
         }
 
-        resp = requests.get(url, headers=head, timeout=30)
-        resp.raise_for_status()
+        with metrics.stage('video_metadata'):
+            info = await get_video_info(url, bv_id)
+        title = clean_filename(info.title)
+        json_data = info.playinfo
 
-        title_match = re.findall('<h1.*?>(.*?)</h1>', resp.text)
-        if not title_match:
-            return False, "无法提取视频标题", None
-        
-        title = clean_filename(title_match[0])
-        
-        json_match = re.findall('<script>window.__playinfo__=(.*?)</script>', resp.text)
-        if not json_match:
-            return False, "无法找到视频信息", None
-        
-        json_data = json.loads(json_match[0])
+        # 下载前按大小限制选择音视频流
+        selection = select_streams(json_data, info.duration, plugin_config.bilibili_max_file_size)
+        if not selection:
+            return False, "无法获取音视频流", None
+        if not selection.fits:
+            # 可以上传群文件且不超过上传上限时照常下载最低画质，由发送端改为上传文件
+            upload_max_size = plugin_config.bilibili_upload_max_size
+            if not plugin_config.bilibili_group_file_upload or 0 < upload_max_size < selection.estimated_size:
+                return False, (
+                    f"视频过大，最低画质预计也有{selection.estimated_size / 1024 / 1024:.1f}MB，"
+                    f"超过发送限制，已跳过下载: {title}"
+                ), None
+            logger.warning(f'最低画质预计{selection.estimated_size / 1024 / 1024:.1f}MB，超过发送限制，下载后上传为文件')
+        video_item, audio_item = selection.video_item, selection.audio_item
+
+        # 按 BV号+cid+清晰度 命名，不受标题重名或改名影响，按码率重编码的单独存放
+        source_id = part_source_id(info.bv_id, page) if info.bv_id else title
+        quality = f"{video_item.get('id', 0)}" + ('r' if selection.video_bitrate else '')
+        cache_key = f"video:{source_id}:{info.cid or 0}:{quality}"
+        file_stem = cache_key.split(':', 1)[1].replace(':', '_')
 
-        audio_path = os.path.join(download_dir, f"{title}_temp.mp3")
-        video_path = os.path.join(download_dir, f"{title}_temp.mp4")
-        output_path = os.path.join(download_dir, f"{title}.mp4")
+        audio_path = os.path.join(download_dir, f"{file_stem}_temp.mp3")
+        video_path = os.path.join(download_dir, f"{file_stem}_temp.mp4")
+        output_path = os.path.join(download_dir, f"{file_stem}.mp4")
 
+        cached = media_cache.get(cache_key)
+        if cached:
+            metrics.inc('bilibili_cache_hits_total', kind='video')
+            return True, f"视频已存在: {title}", cached.path
         if os.path.exists(output_path):
+            metrics.inc('bilibili_cache_hits_total', kind='video')
+            media_cache.put(cache_key, source_id, output_path, title)
             return True, f"视频已存在: {title}", output_path
+        metrics.inc('bilibili_cache_misses_total', kind='video')
 
-        # 安全获取音频URL
-        audio_url = get_media_url(json_data, 'audio')
-        if not audio_url:
-            return False, "无法获取音频流", None
-            
-        audio_data = requests.get(audio_url, headers=head, timeout=60)
-        audio_data.raise_for_status()
-        
-        with open(audio_path, mode='wb') as f:
-            f.write(audio_data.content)
+        # 对 baseUrl/backupUrl 测速，最快的镜像先用，其余留作卡顿时切换
+        with metrics.stage('mirror_probe'):
+            audio_mirrors, video_mirrors = await asyncio.gather(
+                pick_mirrors(candidate_urls(audio_item), head),
+                pick_mirrors(candidate_urls(video_item), head),
+            )
+        if not audio_mirrors or not video_mirrors:
+            return False, "无法获取音视频流", None
+        audio_url, video_url = audio_mirrors[0], video_mirrors[0]
 
-        # 安全获取视频URL
-        video_url = get_media_url(json_data, 'video')
-        if not video_url:
-            cleanup_temp_files(video_path, audio_path)
-            return False, "无法获取视频流", None
-            
-        video_data = requests.get(video_url, headers=head, timeout=60)
-        video_data.raise_for_status()
-        
-        with open(video_path, mode='wb') as f:
-            f.write(video_data.content)
+        mode = pipeline_mode()
+        if mode != 'off':
+            started = time.monotonic()
+            with metrics.stage('pipeline_merge', mode=mode):
+                merged = await pipelined_merge(
+                    mode, video_url, audio_url, head, output_path,
+                    video_item.get('codecs'), audio_item.get('codecs'), selection.video_bitrate,
+                    progress_callback=progress_callback, duration=info.duration
+                )
+            if merged:
+                metrics.record_transfer('video', os.path.getsize(output_path), time.monotonic() - started)
+                media_cache.put(cache_key, source_id, output_path, title)
+                return True, f"下载完成: {title}", output_path
+            logger.warning('边下载边合并失败，改为先下载再合并')
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
+        # 失败时保留 .part 文件和断点清单，下次请求同一视频时断点续传
+        started = time.monotonic()
+        with metrics.stage('cdn_download'):
+            await download_media_pair(
+                audio_url, audio_path, video_url, video_path, head,
+                progress_callback=progress_callback,
+                audio_refresher=make_url_refresher(url, info.bv_id, 'audio', audio_item),
+                video_refresher=make_url_refresher(url, info.bv_id, 'video', video_item),
+                audio_mirrors=audio_mirrors,
+                video_mirrors=video_mirrors,
+            )
+        # 断点续传时包含之前已下载的部分，吞吐量会偏高
+        metrics.record_transfer('video', os.path.getsize(audio_path) + os.path.getsize(video_path),
+                                time.monotonic() - started)
 
-        if merge_audio_video(video_path, audio_path, output_path):
+        # 下载结束，让出网络工作协程，合并只受ffmpeg并发限制
+        release_worker()
+        with metrics.stage('ffmpeg_merge'):
+            merged = await merge_audio_video(
+                video_path, audio_path, output_path,
+                video_item.get('codecs'), audio_item.get('codecs'), selection.video_bitrate,
+                duration=info.duration
+            )
+        if merged:
             cleanup_temp_files(video_path, audio_path)
+            media_cache.put(cache_key, source_id, output_path, title)
             return True, f"下载完成: {title}", output_path
         else:
             cleanup_temp_files(video_path, audio_path)
             return False, "音视频合并失败", None
 
-    except requests.RequestException as e:
+    except MetadataError as e:
+        return False, str(e), None
+    except httpx.HTTPError as e:
         return False, f"网络请求错误: {str(e)}", None
     except json.JSONDecodeError as e:
         return False, f"JSON解析错误: {str(e)}", None
@@ -140,6 +435,18 @@ def download_bilibili_video(url: str, download_dir: str) -> Tuple[bool, str, Opt
         return False, f"未知错误: {str(e)}", None
     
 def get_media_url(json_data: dict, media_type: str) -> Optional[str]:
+    media_item = get_media_item(json_data, media_type)
+    return _media_item_url(media_item) if media_item else None
+
+def _media_item_url(media_item: dict) -> Optional[str]:
+    # 尝试获取URL，优先使用backupUrl，然后baseUrl
+    if 'backupUrl' in media_item and media_item['backupUrl']:
+        return media_item['backupUrl'][0]
+    elif 'baseUrl' in media_item and media_item['baseUrl']:
+        return media_item['baseUrl']
+    return None
+
+def get_media_item(json_data: dict, media_type: str) -> Optional[dict]:
     try:
         media_list = json_data['data']['dash'][media_type]
         if not media_list:
@@ -160,16 +467,10 @@ def get_media_url(json_data: dict, media_type: str) -> Optional[str]:
                     else:
                         continue
                 
-                # 尝试获取URL，优先使用backupUrl，然后baseUrl
-                url = None
-                if 'backupUrl' in media_item and media_item['backupUrl']:
-                    url = media_item['backupUrl'][0]
-                elif 'baseUrl' in media_item and media_item['baseUrl']:
-                    url = media_item['baseUrl']
-                
+                url = _media_item_url(media_item)
                 if url:
                     print(f">>>成功获取{media_type}流，索引: {index}, URL: {url[:50]}...")
-                    return url
+                    return media_item
                     
             except (IndexError, KeyError, TypeError):
                 continue
@@ -0,0 +1,122 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from nonebot.log import logger
+from .config import Config
+
+plugin_config = Config()
+
+try:
+    from playwright.async_api import async_playwright
+    PLAYWRIGHT_AVAILABLE = True
+except ImportError:
+    PLAYWRIGHT_AVAILABLE = False
+
+BROWSER_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-web-security',
+    '--disable-features=VizDisplayCompositor'
+]
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+class PooledPage:
+    def __init__(self, context, page):
+        self.context = context
+        self.page = page
+        self.uses = 0
+
+    async def close(self):
+        try:
+            await self.context.close()
+        except Exception:
+            pass
+
+class BrowserPool:
+    """
+    常驻的Chromium实例 + 预热的页面池
+    同时使用的页面数受 max_pages 限制，页面使用 max_uses 次或出错后关闭重建，浏览器崩溃时自动重启
+    """
+
+    def __init__(self, max_pages: int, max_uses: int):
+        self.max_pages = max_pages
+        self.max_uses = max_uses
+        self._playwright = None
+        self._browser = None
+        self._idle: List[PooledPage] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def start(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._semaphore = asyncio.Semaphore(self.max_pages)
+        async with self._lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            # 浏览器已断开，丢弃旧页面后重启
+            self._idle.clear()
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=True, args=BROWSER_ARGS)
+            logger.debug('浏览器已启动')
+
+    async def _new_page(self) -> PooledPage:
+        context = await self._browser.new_context(
+            viewport={'width': 1200, 'height': 800},
+            device_scale_factor=plugin_config.bilibili_opus_device_scale,
+            user_agent=USER_AGENT
+        )
+        page = await context.new_page()
+        return PooledPage(context, page)
+
+    @asynccontextmanager
+    async def page(self):
+        """
+        取出一个页面，用完自动归还；代码块内抛出异常时该页面直接丢弃
+        """
+        await self.start()
+        async with self._semaphore:
+            pooled = None
+            while self._idle:
+                candidate = self._idle.pop()
+                if not candidate.page.is_closed():
+                    pooled = candidate
+                    break
+                await candidate.close()
+            if pooled is None:
+                pooled = await self._new_page()
+
+            pooled.uses += 1
+            healthy = False
+            try:
+                yield pooled.page
+                healthy = True
+            finally:
+                if healthy and pooled.uses < self.max_uses and self._browser.is_connected():
+                    self._idle.append(pooled)
+                else:
+                    await pooled.close()
+                    if not self._browser.is_connected():
+                        await self.start()
+
+    async def close(self):
+        for pooled in self._idle:
+            await pooled.close()
+        self._idle.clear()
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+browser_pool = BrowserPool(
+    max_pages=plugin_config.bilibili_browser_pages,
+    max_uses=plugin_config.bilibili_browser_max_uses,
+)
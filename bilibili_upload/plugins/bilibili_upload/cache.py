@@ -0,0 +1,177 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Optional
+from nonebot.log import logger
+from .config import Config
+
+plugin_config = Config()
+
+def _path_size(path: str) -> int:
+    # 专栏长图切块后以目录保存
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return os.path.getsize(path)
+
+class CacheEntry:
+    def __init__(self, key: str, source_id: str, path: str, title: Optional[str], size: int,
+                 created_at: float, last_access: float):
+        self.key = key
+        self.source_id = source_id
+        self.path = path
+        self.title = title
+        self.size = size
+        self.created_at = created_at
+        self.last_access = last_access
+
+class MediaCache:
+    """
+    下载结果的持久化索引，保存在下载目录下的SQLite中
+    key 为内容标识：视频 video:BV号:cid:清晰度，专栏 opus:专栏id（path 可能是分块图片目录）
+    source_id 为 BV号/专栏id，用于在抓取页面前直接命中
+    超过 max_bytes 时按最近访问时间淘汰，超过 ttl 秒未访问的条目视为过期
+    """
+
+    def __init__(self, db_path: str, max_bytes: int, ttl: int = 0):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS media_cache (
+                    key TEXT PRIMARY KEY,
+                    source_id TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    title TEXT,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_media_cache_source ON media_cache(source_id)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_media_cache_access ON media_cache(last_access)')
+            self._conn.commit()
+        return self._conn
+
+    def _remove(self, conn: sqlite3.Connection, key: str, path: str):
+        conn.execute('DELETE FROM media_cache WHERE key = ?', (key,))
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+    def _valid(self, conn: sqlite3.Connection, row: tuple, now: float) -> Optional[CacheEntry]:
+        entry = CacheEntry(*row)
+        if self.ttl and now - entry.last_access > self.ttl:
+            self._remove(conn, entry.key, entry.path)
+            return None
+        if not os.path.exists(entry.path):
+            conn.execute('DELETE FROM media_cache WHERE key = ?', (entry.key,))
+            return None
+        conn.execute('UPDATE media_cache SET last_access = ? WHERE key = ?', (now, entry.key))
+        entry.last_access = now
+        return entry
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT * FROM media_cache WHERE key = ?', (key,)).fetchone()
+            entry = self._valid(conn, row, time.time()) if row else None
+            conn.commit()
+            return entry
+
+    def lookup(self, source_id: str) -> Optional[CacheEntry]:
+        """
+        按 BV号/专栏id 查找最近访问过的可用条目，无需先抓取页面
+        """
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            rows = conn.execute(
+                'SELECT * FROM media_cache WHERE source_id = ? ORDER BY last_access DESC', (source_id,)
+            ).fetchall()
+            entry = None
+            for row in rows:
+                entry = self._valid(conn, row, now)
+                if entry:
+                    break
+            conn.commit()
+            return entry
+
+    def title_of(self, path: str) -> Optional[str]:
+        """
+        按文件路径查标题，切块的专栏图片按所在目录查找
+        """
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT title FROM media_cache WHERE path IN (?, ?) AND title IS NOT NULL',
+                (path, os.path.dirname(path))
+            ).fetchone()
+            return row[0] if row else None
+
+    def put(self, key: str, source_id: str, path: str, title: Optional[str] = None) -> None:
+        size = _path_size(path)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO media_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, source_id, path, title, size, now, now)
+            )
+            self._evict(conn, keep=key)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection, keep: Optional[str] = None):
+        if self.ttl:
+            expired = conn.execute(
+                'SELECT key, path FROM media_cache WHERE last_access < ?', (time.time() - self.ttl,)
+            ).fetchall()
+            for key, path in expired:
+                if key != keep:
+                    self._remove(conn, key, path)
+
+        if not self.max_bytes:
+            return
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM media_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, path, size in conn.execute(
+            'SELECT key, path, size FROM media_cache ORDER BY last_access ASC'
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(conn, key, path)
+            total -= size
+            logger.debug(f'缓存淘汰: {path}')
+
+    def evict(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            self._evict(conn)
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+media_cache = MediaCache(
+    os.path.join(plugin_config.bilibili_download_dir, 'cache.db'),
+    max_bytes=plugin_config.bilibili_cache_max_bytes,
+    ttl=plugin_config.bilibili_cache_ttl,
+)
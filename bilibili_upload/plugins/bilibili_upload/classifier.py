@@ -0,0 +1,83 @@
+from typing import List, Optional
+from nonebot.adapters.onebot.v11 import MessageEvent
+from .utils import (
+    VIDEO_URL_PATTERNS,
+    OPUS_URL_PATTERNS,
+    OPUS_ID_PATTERN,
+    PLAIN_BV_PATTERN,
+    extract_bv_id,
+    is_likely_false_positive,
+    is_valid_bv_id,
+)
+
+# 不含这些子串的消息不可能是B站内容，直接跳过，无需运行正则
+PREFILTER_KEYWORDS = ('bilibili.com', 'b23.tv', 'BV')
+
+LINK_VIDEO = 'video'
+LINK_OPUS = 'opus'
+LINK_SHORT = 'short'
+
+class BilibiliLink:
+    """
+    消息分类结果
+    kind: video(视频) / opus(专栏、动态) / short(尚未解析的b23.tv短链)
+    id:   BV号 / 专栏id / 短链代码，视频链接中没有BV号时为None
+    """
+
+    def __init__(self, kind: str, id: Optional[str], url: str):
+        self.kind = kind
+        self.id = id
+        self.url = url
+
+    def __repr__(self) -> str:
+        return f"BilibiliLink(kind={self.kind!r}, id={self.id!r}, url={self.url!r})"
+
+def might_contain_bilibili(text: str) -> bool:
+    return any(keyword in text for keyword in PREFILTER_KEYWORDS)
+
+def classify_links(text: str) -> List[BilibiliLink]:
+    """
+    按出现顺序取出消息中的全部专栏链接、视频链接、b23.tv短链和纯文本BV号，重复的只保留一个
+    链接中自带的BV号不再作为纯文本BV号重复计入；由调用方决定专栏优先还是批量处理视频
+    """
+    if not might_contain_bilibili(text):
+        return []
+    if is_likely_false_positive(text):
+        return []
+
+    found = []
+    url_spans = []
+    for pattern in OPUS_URL_PATTERNS:
+        for match in pattern.finditer(text):
+            url = match.group()
+            url_spans.append(match.span())
+            found.append((match.start(), BilibiliLink(LINK_OPUS, OPUS_ID_PATTERN.search(url).group(1), url)))
+
+    for pattern in VIDEO_URL_PATTERNS:
+        for match in pattern.finditer(text):
+            url = match.group()
+            url_spans.append(match.span())
+            if 'b23.tv' in url:
+                link = BilibiliLink(LINK_SHORT, url.rsplit('/', 1)[-1], url)
+            else:
+                link = BilibiliLink(LINK_VIDEO, extract_bv_id(url), url)
+            found.append((match.start(), link))
+
+    for match in PLAIN_BV_PATTERN.finditer(text):
+        start = match.start(1)
+        bv_id = match.group(1)
+        if any(span_start <= start < span_end for span_start, span_end in url_spans) or not is_valid_bv_id(bv_id):
+            continue
+        found.append((start, BilibiliLink(LINK_VIDEO, bv_id, f"https://www.bilibili.com/video/{bv_id}")))
+
+    found.sort(key=lambda item: item[0])
+    links = {}
+    for _, link in found:
+        links.setdefault(link.url, link)
+    return list(links.values())
+
+async def bilibili_rule(event: MessageEvent) -> bool:
+    """
+    作为 on_message 的 Rule 使用，只做子串预筛，绝大多数消息不会进入处理函数
+    """
+    return might_contain_bilibili(str(event.get_message()))
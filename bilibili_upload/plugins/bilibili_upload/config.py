@@ -2,4 +2,73 @@ from pydantic import BaseModel
 
 class Config(BaseModel):
     bilibili_download_dir: str = "./bilibili_upload/plugins/bilibili_upload/Downloads"
-    bilibili_max_file_size: int = 200 * 1024 * 1024  # 100MB大小限制
\ No newline at end of file
+    bilibili_max_file_size: int = 200 * 1024 * 1024  # 100MB大小限制
+    bilibili_download_chunk_size: int = 1024 * 1024  # 流式下载每块大小，默认1MB
+    bilibili_download_segments: int = 4  # 单个音/视频流同时下载的Range分段数，1为单连接
+    bilibili_segment_min_size: int = 8 * 1024 * 1024  # 小于该大小的流不分段
+    bilibili_segment_retries: int = 3  # 每个分段失败后的重试次数
+    bilibili_merge_mode: str = "auto"  # 音视频合并方式: auto(编码兼容时直接封装) / copy(总是封装) / transcode(总是转码)
+    bilibili_queue_size: int = 20  # 视频任务队列长度，满了直接拒绝
+    bilibili_network_workers: int = 3  # 同时进行下载的任务数
+    bilibili_ffmpeg_workers: int = 1  # 同时运行的ffmpeg进程数
+    bilibili_merge_backlog: int = 3  # 已下载完、等待或正在合并的任务上限，达到后工作协程等合并完成再接新任务，0为不让出
+    bilibili_group_job_limit: int = 3  # 每个群同时排队/处理的任务上限，0为不限制
+    bilibili_user_job_limit: int = 2  # 每个用户同时排队/处理的任务上限，0为不限制
+    bilibili_cache_max_bytes: int = 5 * 1024 * 1024 * 1024  # 下载目录缓存上限，超出后淘汰最久未使用的文件，0为不限制
+    bilibili_cache_ttl: int = 7 * 24 * 3600  # 缓存文件超过该秒数未被使用即过期，0为永不过期
+    bilibili_browser_pages: int = 2  # 常驻浏览器同时截图的页面数
+    bilibili_browser_max_uses: int = 50  # 每个页面使用多少次后重建
+    bilibili_screenshot_ready_timeout: float = 15  # 截图前等待图片加载的最长秒数
+    bilibili_http2: bool = True  # 网页/接口请求使用HTTP/2（需安装h2）
+    bilibili_cdn_max_connections: int = 32  # CDN下载连接池上限
+    bilibili_use_api: bool = True  # 优先用B站JSON接口获取视频/专栏信息，失败时再解析网页
+    bilibili_quality_select: str = "size"  # 画质选择: size(按大小限制选最佳画质) / index(固定索引)
+    bilibili_max_quality: int = 80  # 最高清晰度代码，80=1080P 64=720P 32=480P
+    bilibili_reencode_to_fit: bool = False  # 最低画质也超出大小限制时，按目标码率重新编码
+    bilibili_short_url_cache_size: int = 1024  # b23.tv短链解析结果缓存条数
+    bilibili_short_url_ttl: int = 7 * 24 * 3600  # 短链解析结果缓存秒数
+    bilibili_pipeline_mode: str = "off"  # 边下载边合并: off(先下载再合并) / pipe(管道喂给ffmpeg，仅Linux/macOS) / http(ffmpeg直接读取CDN)
+    bilibili_download_retries: int = 2  # 单个音/视频流整体失败后的重试次数，重试时断点续传
+    bilibili_part_max_age: int = 24 * 3600  # 未完成的 .part 文件保留秒数，超时后启动时清理
+    bilibili_mirror_probe: bool = True  # 下载前对 baseUrl/backupUrl 测速并选择最快的镜像
+    bilibili_mirror_probe_bytes: int = 256 * 1024  # 每个镜像测速下载的字节数
+    bilibili_mirror_probe_timeout: float = 3.0  # 单个镜像测速超时秒数
+    bilibili_mirror_stall_speed: int = 64 * 1024  # 分段下载低于该速度(字节/秒)视为卡顿并切换镜像
+    bilibili_mirror_stall_window: float = 5.0  # 卡顿判定的观察秒数，同时作为读取超时
+    bilibili_transcode_profile: str = "balanced"  # 转码预设: fast(veryfast) / balanced(medium) / small(slow, 体积更小)
+    bilibili_ffmpeg_threads: int = 2  # 每个ffmpeg转码任务使用的线程数，0为ffmpeg自动
+    bilibili_ffmpeg_nice: int = 10  # ffmpeg进程的nice值，0为不调整（仅Linux/macOS）
+    bilibili_ffmpeg_ionice: bool = True  # 用ionice降低ffmpeg磁盘优先级（仅Linux）
+    bilibili_ffmpeg_timeout: int = 1800  # 单个ffmpeg进程最长运行秒数，0为不限制
+    bilibili_opus_format: str = "jpeg"  # 专栏截图格式: png / jpeg / webp，jpeg和webp需安装Pillow
+    bilibili_opus_quality: int = 85  # jpeg/webp 压缩质量 1-100
+    bilibili_opus_device_scale: float = 1.0  # 截图的设备像素比，2为高清截图（体积约为4倍）
+    bilibili_opus_max_width: int = 0  # 截图宽度超过该像素时等比缩小，0为不缩小
+    bilibili_opus_tile_height: int = 4000  # 截图高度超过该像素时切成多张以合并转发发送，0为不切分
+    bilibili_opus_renderer: str = "auto"  # 专栏出图方式: auto(先用接口数据直接排版，失败再用浏览器截图) / browser(只用浏览器)
+    bilibili_opus_font: str = ""  # 直接排版使用的中文字体路径，留空时自动查找系统字体
+    bilibili_opus_fetch_concurrency: int = 8  # 直接排版时同时下载的图片数
+    bilibili_opus_asset_cache_bytes: int = 200 * 1024 * 1024  # 专栏图片素材缓存上限
+    bilibili_screenshot_workers: int = 1  # Selenium/html2image 等阻塞截图方案的专用线程数
+    bilibili_screenshot_timeout: float = 90  # 单个截图方案的最长等待秒数，0为不限制
+    bilibili_breaker_threshold: int = 3  # 截图方案连续失败多少次后暂停使用，0为不熔断
+    bilibili_breaker_cooldown: float = 300  # 截图方案熔断后的冷却秒数
+    bilibili_metrics_window: int = 500  # 计算 p50/p95 时保留的最近样本数
+    bilibili_metrics_log: bool = False  # 每条计时/计数同时输出一行JSON日志
+    bilibili_metrics_path: str = "/bilibili/metrics"  # Prometheus 指标的HTTP路径（需驱动支持HTTP服务），留空不开放
+    bilibili_delivery_mode: str = "path"  # 媒体发送方式: path(本地路径) / shared(换算为OneBot端共享目录路径) / http(内置文件服务，OneBot按URL下载)
+    bilibili_delivery_shared_dir: str = ""  # shared模式下载目录在OneBot端的绝对路径（如容器挂载点）
+    bilibili_delivery_host: str = "127.0.0.1"  # http模式文件服务的监听地址
+    bilibili_delivery_port: int = 18080  # http模式文件服务的端口
+    bilibili_delivery_base_url: str = ""  # OneBot访问文件服务使用的地址，留空为 http://监听地址:端口
+    bilibili_delivery_link_ttl: int = 3600  # http模式文件链接的有效秒数
+    bilibili_file_id_cache: bool = True  # 记住OneBot返回的文件ID，再次发送同一文件时直接引用
+    bilibili_group_file_upload: bool = True  # 文件超过大小限制时改为上传群文件/私聊文件
+    bilibili_upload_max_size: int = 1024 * 1024 * 1024  # 改为上传文件时允许下载的最大预计大小，超出仍跳过下载，0为不限制
+    bilibili_upload_timeout: float = 600  # 发送视频和上传文件的接口超时秒数
+    bilibili_loading_image_url: str = "https://t.alcy.cc/xhl"  # 下载提示附带的随机图片地址，留空只发文字
+    bilibili_loading_pool_size: int = 8  # 后台预先缓存的提示图片数
+    bilibili_loading_refresh_interval: float = 600  # 每隔多少秒后台换入一张新图片，0为不更换
+    bilibili_loading_dir_max_bytes: int = 50 * 1024 * 1024  # images 目录大小上限，超出后删除最旧的图片
+    bilibili_all_parts: bool = False  # 多P视频的链接未指定 p= 时下载全部分P，关闭时只下载第1P
+    bilibili_batch_max_videos: int = 10  # 一条消息最多处理的视频数（含展开的分P），超出的忽略
@@ -0,0 +1,267 @@
+import asyncio
+import mimetypes
+import os
+import re
+import secrets
+import time
+from pathlib import Path, PurePosixPath
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import quote, unquote
+from nonebot.adapters.onebot.v11 import Bot, Message, MessageEvent, MessageSegment
+from nonebot.adapters.onebot.v11.exception import ActionFailed
+from nonebot.log import logger
+from .config import Config
+from .metrics import metrics
+from .persisted import PersistedDict
+
+plugin_config = Config()
+
+# 请求头最大长度，超出直接断开
+MAX_HEADER_SIZE = 8 * 1024
+
+def _file_key(path: str) -> Optional[str]:
+    # 同一路径的文件被重新下载后大小或修改时间会变化，旧ID不再适用
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f'{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}'
+
+class FileIdCache:
+    """
+    OneBot 上传文件后返回的文件ID，key 为 路径:大小:修改时间
+    再次发送同一文件时直接引用ID，不再由OneBot读取和上传；定期及关闭时写入文件
+    """
+
+    def __init__(self, cache_path: str, max_size: int = 4096):
+        # 超出上限时丢弃最早记录的
+        self._ids = PersistedDict(cache_path, max_size, '文件ID缓存')
+        # 发送时被OneBot拒绝过的ID，不再记录
+        self._rejected: Set[str] = set()
+
+    def get(self, path: str) -> Optional[str]:
+        key = _file_key(path)
+        return self._ids.get(key) if key else None
+
+    def put(self, path: str, file_id: str):
+        key = _file_key(path)
+        if not key or file_id in self._rejected:
+            return
+        self._ids.set(key, file_id)
+
+    def discard(self, path: str):
+        key = _file_key(path)
+        file_id = self._ids.pop(key) if key else None
+        if file_id is not None:
+            self._rejected.add(file_id)
+
+    def save(self):
+        self._ids.save()
+
+class FileServer:
+    """
+    http 模式的内置文件服务，只提供登记过的文件，链接带随机token并在 ttl 秒后失效
+    响应体用 loop.sendfile 发送，系统支持时由内核直接从文件拷贝到socket
+    """
+
+    def __init__(self, host: str, port: int, base_url: str, ttl: int):
+        self.host = host
+        self.port = port
+        self.base_url = (base_url or f'http://{host}:{port}').rstrip('/')
+        self.ttl = ttl
+        self._files: Dict[str, Tuple[str, float]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            logger.debug(f'文件服务已启动: {self.base_url}')
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def publish(self, path: str) -> str:
+        now = time.time()
+        for token, (_, expires_at) in list(self._files.items()):
+            if expires_at <= now:
+                del self._files[token]
+        token = secrets.token_urlsafe(16)
+        self._files[token] = (os.path.abspath(path), now + self.ttl)
+        return f'{self.base_url}/{token}/{quote(os.path.basename(path))}'
+
+    def _lookup(self, request_path: str) -> Optional[str]:
+        parts = unquote(request_path.split('?', 1)[0]).strip('/').split('/', 1)
+        entry = self._files.get(parts[0])
+        if entry is None or entry[1] <= time.time() or not os.path.isfile(entry[0]):
+            return None
+        return entry[0]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=30)
+            if len(head) > MAX_HEADER_SIZE:
+                return
+            lines = head.decode('latin-1').split('\r\n')
+            method, request_path = lines[0].split(' ')[:2]
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+
+            path = self._lookup(request_path) if method in ('GET', 'HEAD') else None
+            if path is None:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                await writer.drain()
+                return
+
+            size = os.path.getsize(path)
+            start, end = 0, size - 1
+            status = '200 OK'
+            match = re.match(r'bytes=(\d*)-(\d*)$', headers.get('range', ''))
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2) or size - 1), size - 1)
+                else:
+                    start = max(0, size - int(match.group(2)))
+                if start > end:
+                    writer.write(f'HTTP/1.1 416 Range Not Satisfiable\r\nContent-Range: bytes */{size}\r\n'
+                                 'Content-Length: 0\r\nConnection: close\r\n\r\n'.encode())
+                    await writer.drain()
+                    return
+                status = '206 Partial Content'
+
+            length = end - start + 1
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            response = [
+                f'HTTP/1.1 {status}',
+                f'Content-Type: {content_type}',
+                f'Content-Length: {length}',
+                'Accept-Ranges: bytes',
+                'Connection: close',
+            ]
+            if status.startswith('206'):
+                response.append(f'Content-Range: bytes {start}-{end}/{size}')
+            writer.write(('\r\n'.join(response) + '\r\n\r\n').encode())
+            await writer.drain()
+            if method == 'GET' and length > 0:
+                with open(path, 'rb') as f:
+                    await asyncio.get_running_loop().sendfile(writer.transport, f, start, length)
+            metrics.inc('bilibili_file_server_requests_total', status=status.split(' ')[0])
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        except Exception as e:
+            logger.warning(f'文件服务出错: {e}')
+        finally:
+            writer.close()
+
+def locate(path: str, as_uri: bool = True) -> str:
+    """
+    返回OneBot端能访问的文件地址；as_uri=False 时返回上传文件接口使用的普通路径
+    """
+    mode = plugin_config.bilibili_delivery_mode
+    if mode == 'http':
+        return file_server.publish(path)
+    local_path = Path(path).resolve()
+    if mode == 'shared' and plugin_config.bilibili_delivery_shared_dir:
+        shared = PurePosixPath(plugin_config.bilibili_delivery_shared_dir)
+        try:
+            relative = local_path.relative_to(Path(plugin_config.bilibili_download_dir).resolve())
+        except ValueError:
+            relative = None
+        if relative is not None and shared.is_absolute():
+            mapped = shared.joinpath(*relative.parts)
+            return mapped.as_uri() if as_uri else str(mapped)
+    return local_path.as_uri() if as_uri else str(local_path)
+
+def media_segment(kind: str, path: str, file_id: Optional[str] = None) -> MessageSegment:
+    """
+    kind 为 image / video；给出文件ID时直接引用，否则使用 locate 得到的地址
+    """
+    factory = MessageSegment.video if kind == 'video' else MessageSegment.image
+    metrics.inc('bilibili_delivery_total', method='file_id' if file_id else plugin_config.bilibili_delivery_mode)
+    return factory(file_id or locate(path))
+
+def cached_file_id(path: str) -> Optional[str]:
+    return file_ids.get(path) if plugin_config.bilibili_file_id_cache else None
+
+def _message_segments(message) -> list:
+    if isinstance(message, str):
+        return [{'type': segment.type, 'data': segment.data} for segment in Message(message)]
+    return list(message or [])
+
+async def _remember_file_id(bot: Bot, kind: str, path: str, message_id: int, sent_file: str):
+    """
+    从已发送的消息中取出OneBot明确返回的 file_id；file 字段多为文件名或哈希，不能用来重发，不予记录
+    """
+    try:
+        result = await bot.get_msg(message_id=message_id)
+    except Exception:
+        return
+    for segment in _message_segments(result.get('message')):
+        if segment.get('type') != kind:
+            continue
+        data = segment.get('data') or {}
+        file_id = data.get('file_id')
+        # 原样返回的本地路径/链接不算文件ID
+        if file_id and file_id != sent_file and not re.match(r'(file|base64|https?)://', str(file_id)):
+            file_ids.put(path, str(file_id))
+        return
+
+async def send_media(bot: Bot, event: MessageEvent, text: str, kind: str, path: str):
+    """
+    发送文字+图片/视频；引用缓存的文件ID失败时作废该ID并改用文件地址重发
+    """
+    file_id = cached_file_id(path)
+    segment = media_segment(kind, path, file_id)
+    try:
+        result = await bot.send(event, MessageSegment.text(text) + segment,
+                                _timeout=plugin_config.bilibili_upload_timeout)
+    except ActionFailed:
+        if not file_id:
+            raise
+        logger.warning(f'文件ID已失效，重新发送文件: {path}')
+        file_ids.discard(path)
+        file_id = None
+        segment = media_segment(kind, path)
+        result = await bot.send(event, MessageSegment.text(text) + segment,
+                                _timeout=plugin_config.bilibili_upload_timeout)
+    message_id = (result or {}).get('message_id')
+    if plugin_config.bilibili_file_id_cache and not file_id and message_id is not None:
+        await _remember_file_id(bot, kind, path, message_id, segment.data['file'])
+
+async def upload_file(bot: Bot, event: MessageEvent, path: str, name: Optional[str] = None) -> bool:
+    """
+    超过消息大小限制的文件改为上传群文件（私聊时上传私聊文件），接口不支持或失败时返回False
+    """
+    if not plugin_config.bilibili_group_file_upload:
+        return False
+    name = name or os.path.basename(path)
+    file = locate(path, as_uri=False)
+    group_id = getattr(event, 'group_id', None)
+    try:
+        if group_id:
+            await bot.upload_group_file(group_id=group_id, file=file, name=name,
+                                        _timeout=plugin_config.bilibili_upload_timeout)
+        else:
+            await bot.upload_private_file(user_id=event.user_id, file=file, name=name,
+                                          _timeout=plugin_config.bilibili_upload_timeout)
+    except Exception as e:
+        logger.warning(f'上传文件失败: {e}')
+        return False
+    metrics.inc('bilibili_delivery_total', method='upload')
+    return True
+
+file_ids = FileIdCache(os.path.join(plugin_config.bilibili_download_dir, 'file_ids.json'))
+
+file_server = FileServer(
+    plugin_config.bilibili_delivery_host,
+    plugin_config.bilibili_delivery_port,
+    plugin_config.bilibili_delivery_base_url,
+    ttl=plugin_config.bilibili_delivery_link_ttl,
+)
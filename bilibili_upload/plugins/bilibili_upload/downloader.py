@@ -0,0 +1,392 @@
+import asyncio
+import json
+import os
+import re
+import time
+import httpx
+from typing import Awaitable, Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+from nonebot.log import logger
+from .config import Config
+from .http_client import get_client
+from .mirrors import host_scores, rank_by_score, url_host
+
+plugin_config = Config()
+
+ProgressCallback = Callable[[int, Optional[int]], None]
+UrlRefresher = Callable[[], Awaitable[Optional[List[str]]]]
+
+# 签名过期的CDN链接通常返回这些状态码
+EXPIRED_STATUS = (403, 404, 410)
+# 断点清单最少间隔多久写一次磁盘
+MANIFEST_SAVE_INTERVAL = 2.0
+
+def url_identity(url: str) -> str:
+    """
+    CDN链接去掉签名参数后的路径，刷新链接或换镜像后仍指向同一个流
+    """
+    return urlparse(url).path
+
+class PartManifest:
+    """
+    .part 文件旁的断点清单，记录流标识、总大小和已完成的字节区间
+    """
+
+    def __init__(self, path: str, url_id: str, size: int, done: Optional[List[List[int]]] = None):
+        self.path = path
+        self.url_id = url_id
+        self.size = size
+        self.done = done or []
+        self._last_save = 0.0
+
+    @classmethod
+    def load(cls, path: str) -> Optional['PartManifest']:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(path, data['url_id'], data['size'], data['done'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @property
+    def completed_bytes(self) -> int:
+        return sum(end - start + 1 for start, end in self.done)
+
+    def mark(self, start: int, end: int):
+        merged = []
+        for interval in sorted(self.done + [[start, end]]):
+            if merged and interval[0] <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], interval[1])
+            else:
+                merged.append(list(interval))
+        self.done = merged
+        self.save()
+
+    def missing_ranges(self) -> List[Tuple[int, int]]:
+        missing = []
+        position = 0
+        for start, end in self.done:
+            if start > position:
+                missing.append((position, start - 1))
+            position = max(position, end + 1)
+        if position < self.size:
+            missing.append((position, self.size - 1))
+        return missing
+
+    def save(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_save < MANIFEST_SAVE_INTERVAL:
+            return
+        self._last_save = now
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'url_id': self.url_id, 'size': self.size, 'done': self.done}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class MirrorStalled(httpx.HTTPError):
+    """当前镜像速度过低，需要换镜像"""
+
+class StreamSource:
+    """
+    当前使用的下载链接及备用镜像，签名过期时通过 refresher 重新获取，多个分段共用同一次刷新/切换
+    """
+
+    def __init__(self, url: str, refresher: Optional[UrlRefresher] = None,
+                 mirrors: Optional[List[str]] = None):
+        self.mirrors = list(mirrors or [url])
+        if url not in self.mirrors:
+            self.mirrors.insert(0, url)
+        self.url = url
+        self.refresher = refresher
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, failed_url: str) -> bool:
+        async with self._lock:
+            if self.url != failed_url:
+                return True
+            if not self.refresher:
+                return False
+            new_urls = await self.refresher()
+            if not new_urls:
+                return False
+            self.mirrors = rank_by_score(new_urls)
+            self.url = self.mirrors[0]
+            logger.debug(f'下载链接已过期，已刷新: {self.url[:50]}...')
+            return True
+
+    async def switch(self, failed_url: str) -> bool:
+        """
+        换到下一个镜像，没有其他镜像时返回False
+        """
+        async with self._lock:
+            if self.url != failed_url:
+                return True
+            if len(self.mirrors) <= 1:
+                return False
+            host_scores.penalize(url_host(failed_url))
+            index = self.mirrors.index(failed_url) if failed_url in self.mirrors else -1
+            self.url = self.mirrors[(index + 1) % len(self.mirrors)]
+            logger.warning(f'镜像 {url_host(failed_url)} 速度过低，切换到 {url_host(self.url)}')
+            return True
+
+def _is_expired(error: Exception) -> bool:
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in EXPIRED_STATUS
+
+async def download_stream(url: str, path: str, headers: dict,
+                          chunk_size: Optional[int] = None,
+                          progress_callback: Optional[ProgressCallback] = None) -> int:
+    """
+    流式下载到文件，按块写入，内存占用与文件大小无关
+    先写入 .part，完成后再改名，中断时不会留下看似完整的文件
+    progress_callback(已下载字节数, 总字节数或None)
+    """
+    chunk_size = chunk_size or plugin_config.bilibili_download_chunk_size
+    part_path = path + '.part'
+    downloaded = 0
+    async with get_client(url).stream('GET', url, headers=headers) as response:
+        response.raise_for_status()
+        total = response.headers.get('Content-Length')
+        total = int(total) if total and total.isdigit() else None
+        with open(part_path, mode='wb') as f:
+            async for chunk in response.aiter_bytes(chunk_size):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                downloaded += len(chunk)
+                if progress_callback:
+                    progress_callback(downloaded, total)
+    os.replace(part_path, path)
+    return downloaded
+
+async def probe_content_length(url: str, headers: dict) -> Tuple[Optional[int], bool]:
+    """
+    用 Range: bytes=0-0 探测文件总大小以及服务器是否支持分段下载
+    返回 (总大小或None, 是否支持Range)
+    """
+    probe_headers = dict(headers, Range='bytes=0-0')
+    async with get_client(url).stream('GET', url, headers=probe_headers, timeout=15) as response:
+        response.raise_for_status()
+        if response.status_code == 206:
+            match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+            if match:
+                return int(match.group(1)), True
+        total = response.headers.get('Content-Length')
+        return (int(total) if total and total.isdigit() else None), False
+
+def split_ranges(total: int, segments: int) -> List[Tuple[int, int]]:
+    segments = max(1, min(segments, total))
+    size = total // segments
+    ranges = []
+    for i in range(segments):
+        start = i * size
+        end = total - 1 if i == segments - 1 else start + size - 1
+        ranges.append((start, end))
+    return ranges
+
+def split_missing_ranges(missing: List[Tuple[int, int]], segments: int) -> List[Tuple[int, int]]:
+    """
+    把尚未完成的区间按大小比例拆成约 segments 个分段
+    """
+    remaining = sum(end - start + 1 for start, end in missing)
+    pieces = []
+    for start, end in missing:
+        count = max(1, round(segments * (end - start + 1) / remaining))
+        pieces.extend((start + s, start + e) for s, e in split_ranges(end - start + 1, count))
+    return pieces
+
+async def download_segment(source: StreamSource, path: str, headers: dict, start: int, end: int,
+                           manifest: PartManifest,
+                           on_chunk: Optional[Callable[[int], None]] = None,
+                           retries: Optional[int] = None) -> None:
+    """
+    下载 [start, end] 区间并写入文件对应偏移处，每块写完记入断点清单
+    失败时从已完成的位置继续，链接过期时先刷新链接
+    """
+    chunk_size = plugin_config.bilibili_download_chunk_size
+    retries = plugin_config.bilibili_segment_retries if retries is None else retries
+    stall_window = plugin_config.bilibili_mirror_stall_window
+    stall_speed = plugin_config.bilibili_mirror_stall_speed
+    # 读取超时同样按卡顿处理，换镜像重试
+    timeout = httpx.Timeout(60.0, read=stall_window) if stall_window > 0 and len(source.mirrors) > 1 else None
+    position = start
+    last_error = None
+    for attempt in range(retries + 1):
+        url = source.url
+        window_start = time.monotonic()
+        window_bytes = 0
+        try:
+            segment_headers = dict(headers, Range=f'bytes={position}-{end}')
+            stream_kwargs = {'timeout': timeout} if timeout else {}
+            async with get_client(url).stream('GET', url, headers=segment_headers, **stream_kwargs) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise httpx.HTTPError(f"服务器未按Range返回数据: {response.status_code}")
+                with open(path, mode='r+b') as f:
+                    f.seek(position)
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        f.flush()
+                        manifest.mark(position, position + len(chunk) - 1)
+                        position += len(chunk)
+                        window_bytes += len(chunk)
+                        if on_chunk:
+                            on_chunk(len(chunk))
+                        elapsed = time.monotonic() - window_start
+                        if stall_window > 0 and elapsed >= stall_window:
+                            host_scores.record(url_host(url), window_bytes, elapsed)
+                            if window_bytes / elapsed < stall_speed and len(source.mirrors) > 1:
+                                raise MirrorStalled(f"镜像速度过低: {window_bytes / elapsed / 1024:.0f}KB/s")
+                            window_start, window_bytes = time.monotonic(), 0
+            host_scores.record(url_host(url), window_bytes, time.monotonic() - window_start)
+            if position != end + 1:
+                raise httpx.HTTPError(f"分段数据不完整: {position - start}/{end - start + 1}")
+            return
+        except httpx.HTTPError as e:
+            last_error = e
+            if _is_expired(e) and not await source.refresh(url):
+                break
+            if isinstance(e, (MirrorStalled, httpx.TimeoutException)) and await source.switch(url):
+                # 换镜像后直接从断点继续
+                logger.debug(f'分段 {start}-{end} 切换镜像继续下载')
+                continue
+            logger.warning(f'分段 {start}-{end} 第{attempt + 1}次下载失败: {e}')
+    raise last_error
+
+async def download_resumable(source: StreamSource, path: str, headers: dict, total: int,
+                             progress_callback: Optional[ProgressCallback] = None,
+                             segments: int = 1) -> int:
+    """
+    下载到 .part 并维护断点清单；清单与当前流一致时只下载缺失的区间
+    """
+    part_path = path + '.part'
+    url_id = url_identity(source.url)
+    manifest = PartManifest.load(part_path + '.json')
+    if manifest and (manifest.url_id != url_id or manifest.size != total or not os.path.exists(part_path)):
+        manifest = None
+    if manifest is None:
+        with open(part_path, mode='wb') as f:
+            f.truncate(total)
+        manifest = PartManifest(part_path + '.json', url_id, total)
+        manifest.save(force=True)
+    elif manifest.done:
+        logger.debug(f'断点续传，已完成 {manifest.completed_bytes * 100 // total}%')
+
+    downloaded = manifest.completed_bytes
+
+    def on_chunk(size: int):
+        nonlocal downloaded
+        downloaded += size
+        if progress_callback:
+            progress_callback(downloaded, total)
+
+    missing = manifest.missing_ranges()
+    tasks = [
+        asyncio.create_task(download_segment(source, part_path, headers, start, end, manifest, on_chunk))
+        for start, end in (split_missing_ranges(missing, segments) if missing else [])
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        manifest.save(force=True)
+
+    os.replace(part_path, path)
+    manifest.remove()
+    return total
+
+async def download_media(url: str, path: str, headers: dict,
+                         progress_callback: Optional[ProgressCallback] = None,
+                         segments: Optional[int] = None,
+                         refresher: Optional[UrlRefresher] = None,
+                         mirrors: Optional[List[str]] = None) -> int:
+    """
+    支持Range的服务器：下载到 .part 并记录断点，大文件拆成多个分段并行下载
+    不支持Range时退回单连接流式下载
+    整体失败时按 bilibili_download_retries 重试，重试会从断点继续，链接过期时先刷新
+    mirrors 为同一个流的备用镜像，分段下载卡顿时切换
+    """
+    segments = segments or plugin_config.bilibili_download_segments
+    source = StreamSource(url, refresher, mirrors)
+    last_error = None
+    for attempt in range(plugin_config.bilibili_download_retries + 1):
+        try:
+            try:
+                total, accepts_ranges = await probe_content_length(source.url, headers)
+            except httpx.HTTPStatusError:
+                raise
+            except httpx.HTTPError:
+                total, accepts_ranges = None, False
+
+            if not accepts_ranges or not total:
+                return await download_stream(source.url, path, headers, progress_callback=progress_callback)
+            if os.path.exists(path) and os.path.getsize(path) == total:
+                # 上次已下载完成但未来得及合并
+                return total
+            count = segments if total >= plugin_config.bilibili_segment_min_size else 1
+            return await download_resumable(source, path, headers, total, progress_callback, count)
+        except httpx.HTTPError as e:
+            last_error = e
+            if _is_expired(e) and not await source.refresh(source.url):
+                break
+            if not _is_expired(e):
+                await source.switch(source.url)
+            logger.warning(f'第{attempt + 1}次下载失败: {e}')
+    raise last_error
+
+async def download_media_pair(audio_url: str, audio_path: str, video_url: str, video_path: str,
+                              headers: dict,
+                              progress_callback: Optional[Callable[[str, int, Optional[int]], None]] = None,
+                              audio_refresher: Optional[UrlRefresher] = None,
+                              video_refresher: Optional[UrlRefresher] = None,
+                              audio_mirrors: Optional[List[str]] = None,
+                              video_mirrors: Optional[List[str]] = None) -> None:
+    """
+    音频和视频同时下载，任意一路失败即抛出异常
+    """
+    def stream_progress(media_type: str):
+        if not progress_callback:
+            return None
+        return lambda downloaded, total: progress_callback(media_type, downloaded, total)
+
+    tasks = [
+        asyncio.create_task(download_media(audio_url, audio_path, headers, stream_progress('audio'),
+                                           refresher=audio_refresher, mirrors=audio_mirrors)),
+        asyncio.create_task(download_media(video_url, video_path, headers, stream_progress('video'),
+                                           refresher=video_refresher, mirrors=video_mirrors)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def cleanup_stale_parts(download_dir: str, max_age: int) -> None:
+    """
+    删除超过 max_age 秒未更新的 .part 文件及其断点清单
+    """
+    if not os.path.isdir(download_dir):
+        return
+    now = time.time()
+    for name in os.listdir(download_dir):
+        if not (name.endswith('.part') or name.endswith('.part.json')):
+            continue
+        path = os.path.join(download_dir, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
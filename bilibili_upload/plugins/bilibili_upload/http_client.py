@@ -0,0 +1,73 @@
+import httpx
+from importlib.util import find_spec
+from typing import Dict
+from urllib.parse import urlparse
+from .config import Config
+
+plugin_config = Config()
+
+# HTTP/2 需要额外安装 h2 (pip install httpx[http2])，只检查是否已安装，由httpx自行导入
+HTTP2_AVAILABLE = find_spec('h2') is not None
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept-Language': 'zh-CN,zh;q=0.8,zh-TW;q=0.7,zh-HK;q=0.5,en-US;q=0.3,en;q=0.2',
+    'Referer': 'https://www.bilibili.com/',
+}
+
+WEB_HOSTS = ('bilibili.com',)
+SHORT_HOSTS = ('b23.tv',)
+CDN_HOSTS = ('bilivideo.com', 'bilivideo.cn', 'akamaized.net', 'hdslb.com')
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+def host_group(url: str) -> str:
+    """
+    按域名划分连接池：web(网页/接口) / short(b23.tv短链) / cdn(音视频与图片) / other
+    """
+    host = (urlparse(url).hostname or '').lower()
+    for group, suffixes in (('short', SHORT_HOSTS), ('cdn', CDN_HOSTS), ('web', WEB_HOSTS)):
+        if any(host == suffix or host.endswith('.' + suffix) for suffix in suffixes):
+            return group
+    # upos-xxx 之类的镜像节点域名不固定，按前缀归到cdn
+    if host.startswith('upos-') or host.startswith('cn-'):
+        return 'cdn'
+    return 'other'
+
+def _create_client(group: str) -> httpx.AsyncClient:
+    if group == 'cdn':
+        # 分段下载依赖多条并行连接，CDN 使用 HTTP/1.1 keep-alive 而非单连接多路复用
+        return httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            http2=False,
+            follow_redirects=True,
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=plugin_config.bilibili_cdn_max_connections,
+                max_keepalive_connections=plugin_config.bilibili_cdn_max_connections,
+                keepalive_expiry=30.0,
+            ),
+        )
+    return httpx.AsyncClient(
+        headers=DEFAULT_HEADERS,
+        http2=plugin_config.bilibili_http2 and HTTP2_AVAILABLE,
+        follow_redirects=True,
+        timeout=httpx.Timeout(30.0, connect=10.0) if group != 'short' else httpx.Timeout(10.0),
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0),
+    )
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """
+    返回该URL所属域名组的共享客户端，首次使用时创建
+    """
+    group = host_group(url)
+    client = _clients.get(group)
+    if client is None or client.is_closed:
+        client = _create_client(group)
+        _clients[group] = client
+    return client
+
+async def close_clients():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
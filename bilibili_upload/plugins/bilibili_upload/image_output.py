@@ -0,0 +1,113 @@
+import math
+import os
+import shutil
+from typing import List, Optional
+from nonebot.log import logger
+from .config import Config
+
+plugin_config = Config()
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+IMAGE_EXTENSIONS = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp'}
+# WebP 单边最大像素
+WEBP_MAX_SIZE = 16383
+
+def output_format() -> str:
+    fmt = plugin_config.bilibili_opus_format.lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in IMAGE_EXTENSIONS or not PIL_AVAILABLE:
+        # 没有Pillow时只能保留浏览器输出的PNG
+        return 'png'
+    return fmt
+
+def output_path_for(base: str) -> Optional[str]:
+    """
+    按当前配置查找已生成的结果：单张图片 base.ext，或分块目录 base/
+    """
+    for path in (base + IMAGE_EXTENSIONS[output_format()], base):
+        if os.path.exists(path):
+            return path
+    return None
+
+def list_images(path: str) -> List[str]:
+    """
+    单张图片返回自身，分块目录返回按顺序排列的分块
+    """
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    return [path]
+
+def tile_height(fmt: str) -> int:
+    height = plugin_config.bilibili_opus_tile_height
+    if fmt == 'webp':
+        height = min(height, WEBP_MAX_SIZE) if height > 0 else WEBP_MAX_SIZE
+    return height
+
+def _save(image, path: str, fmt: str):
+    if fmt == 'png':
+        image.save(path, 'PNG', optimize=True)
+    elif fmt == 'jpeg':
+        image.convert('RGB').save(path, 'JPEG', quality=plugin_config.bilibili_opus_quality,
+                                  optimize=True, progressive=True)
+    else:
+        image.save(path, 'WEBP', quality=plugin_config.bilibili_opus_quality, method=4)
+
+def postprocess_screenshot(raw_path: str, base: str) -> str:
+    """
+    把浏览器输出的PNG转成配置的格式，过宽时等比缩小，过高时切成多块
+    返回单张图片路径，或存放分块（01.jpg, 02.jpg...）的目录 base/
+    没有Pillow或不需要处理时原样返回PNG
+    """
+    fmt = output_format()
+    max_width = plugin_config.bilibili_opus_max_width
+    if not PIL_AVAILABLE:
+        return raw_path
+
+    image = Image.open(raw_path)
+    try:
+        width, height = image.size
+        resized = bool(max_width and width > max_width)
+        if resized:
+            height = round(height * max_width / width)
+            width = max_width
+            # 缩小后的是新图片，原图的文件句柄和解码数据立即释放
+            source = image
+            image = source.resize((width, height), Image.LANCZOS)
+            source.close()
+
+        limit = tile_height(fmt)
+        count = math.ceil(height / limit) if limit > 0 else 1
+        ext = IMAGE_EXTENSIONS[fmt]
+
+        if count <= 1:
+            path = base + ext
+            if path == raw_path and not resized:
+                return raw_path
+            _save(image, path + '.tmp', fmt)
+            os.replace(path + '.tmp', path)
+        else:
+            # 各块高度均分，避免最后一块过矮
+            step = math.ceil(height / count)
+            tmp_dir = base + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            for index in range(count):
+                tile = image.crop((0, index * step, width, min(height, (index + 1) * step)))
+                _save(tile, os.path.join(tmp_dir, f'{index + 1:02d}{ext}'), fmt)
+                tile.close()
+            shutil.rmtree(base, ignore_errors=True)
+            os.replace(tmp_dir, base)
+            path = base
+            logger.debug(f'专栏截图过长，已切成{count}张')
+    finally:
+        image.close()
+
+    if raw_path != path:
+        os.remove(raw_path)
+    return path
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from typing import List, Optional
+from nonebot.log import logger
+from .config import Config
+from .http_client import get_client
+
+plugin_config = Config()
+
+CONTENT_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+
+class LoadingImagePool:
+    """
+    下载提示用的随机图片池：后台预先下载 size 张并定期换入新图，发送时直接轮流取用本地文件
+    图片目录超过 max_bytes 或图片数超过 size 时删除最旧的
+    """
+
+    def __init__(self, image_dir: str, url: str, size: int, refresh_interval: float, max_bytes: int):
+        self.image_dir = image_dir
+        self.url = url
+        self.size = max(1, size)
+        self.refresh_interval = refresh_interval
+        self.max_bytes = max_bytes
+        self._images: List[str] = []
+        self._next = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _scan(self) -> List[str]:
+        if not os.path.isdir(self.image_dir):
+            return []
+        entries = [entry for entry in os.scandir(self.image_dir) if entry.is_file() and not entry.name.endswith('.tmp')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        return [entry.path for entry in entries]
+
+    def _evict(self):
+        """
+        只保留最新的 size 张，并保证目录总大小不超过 max_bytes（至少保留一张）
+        """
+        images = self._scan()
+        while len(images) > self.size:
+            self._remove(images.pop(0))
+        if self.max_bytes:
+            total = sum(os.path.getsize(path) for path in images)
+            while total > self.max_bytes and len(images) > 1:
+                path = images.pop(0)
+                total -= os.path.getsize(path)
+                self._remove(path)
+        self._images = images
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    async def fetch_one(self) -> Optional[str]:
+        response = await get_client(self.url).get(self.url, timeout=10.0)
+        content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+        if response.status_code != 200 or not content_type.startswith('image/'):
+            logger.warning(f'获取提示图片失败，状态码: {response.status_code}, 类型: {content_type}, 最终URL: {response.url}')
+            return None
+        ext = CONTENT_EXTENSIONS.get(content_type) or os.path.splitext(response.url.path)[1] or '.jpg'
+        os.makedirs(self.image_dir, exist_ok=True)
+        path = os.path.join(self.image_dir, f'loading_{time.time_ns()}{ext}')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(response.content)
+        os.replace(path + '.tmp', path)
+        await asyncio.to_thread(self._evict)
+        return path
+
+    async def _fetch_safely(self):
+        try:
+            await self.fetch_one()
+        except Exception as e:
+            logger.warning(f'获取提示图片出错: {e}')
+
+    async def _run(self):
+        await asyncio.to_thread(self._evict)
+        # 启动时补齐到 size 张，失败的留给之后的定期更换
+        for _ in range(self.size - len(self._images)):
+            await self._fetch_safely()
+        while self.refresh_interval:
+            await asyncio.sleep(self.refresh_interval)
+            await self._fetch_safely()
+
+    def start(self):
+        if self.url and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def pick(self) -> Optional[str]:
+        """
+        轮流返回一张已缓存的图片，池为空时返回None（只发文字），不会等待网络
+        """
+        images = [path for path in self._images if os.path.exists(path)]
+        if not images:
+            return None
+        self._next = (self._next + 1) % len(images)
+        return images[self._next]
+
+loading_images = LoadingImagePool(
+    os.path.join(plugin_config.bilibili_download_dir, 'images'),
+    plugin_config.bilibili_loading_image_url,
+    size=plugin_config.bilibili_loading_pool_size,
+    refresh_interval=plugin_config.bilibili_loading_refresh_interval,
+    max_bytes=plugin_config.bilibili_loading_dir_max_bytes,
+)
@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Tuple
+from nonebot.log import logger
+from .config import Config
+
+plugin_config = Config()
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+def _format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+class Histogram:
+    """
+    累计 count/sum 用于 Prometheus，最近 window 个样本用于计算 p50/p95
+    """
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+class Metrics:
+    """
+    进程内的计数器和直方图，可导出为 Prometheus 文本格式；开启 bilibili_metrics_log 时每条记录同时输出一行JSON
+    """
+
+    def __init__(self, window: int = 500, log: bool = False):
+        self.window = window
+        self.log = log
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def _emit(self, kind: str, name: str, value: float, labels: dict):
+        if self.log:
+            record = {'type': kind, 'name': name, 'value': round(value, 4), **labels}
+            # 结构化记录放在 extra['metric'] 中，便于日志 sink 按字段过滤
+            logger.bind(metric=record).info('metrics {}', json.dumps(record, ensure_ascii=False))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+        self._emit('counter', name, value, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self.window)
+            series[key].observe(value)
+        self._emit('histogram', name, value, labels)
+
+    @contextmanager
+    def stage(self, stage: str, **labels):
+        """
+        记录代码块耗时到 bilibili_stage_seconds，抛出异常时额外计入 bilibili_stage_errors_total
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.inc('bilibili_stage_errors_total', stage=stage, **labels)
+            raise
+        finally:
+            self.observe('bilibili_stage_seconds', time.monotonic() - start, stage=stage, **labels)
+
+    def record_transfer(self, kind: str, size: int, elapsed: float):
+        """
+        记录下载字节数和吞吐量（字节/秒）
+        """
+        self.inc('bilibili_download_bytes_total', size, kind=kind)
+        if size and elapsed > 0:
+            self.observe('bilibili_download_throughput_bytes', size / elapsed, kind=kind)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in series.items():
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {name} summary')
+                for labels, histogram in series.items():
+                    samples = list(histogram.samples)
+                    for quantile in (0.5, 0.95):
+                        quantile_labels = labels + (('quantile', str(quantile)),)
+                        lines.append(f'{name}{_format_labels(quantile_labels)} '
+                                     f'{_format_value(percentile(samples, quantile * 100))}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram.total)}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """
+        供 /bili_stats 使用的可读摘要：各阶段 p50/p95 和计数器
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                unit = 'MB/s' if 'throughput' in name else 's'
+                scale = 1024 * 1024 if unit == 'MB/s' else 1
+                for labels, histogram in sorted(series.items()):
+                    samples = list(histogram.samples)
+                    label_text = ' '.join(label_value for _, label_value in labels)
+                    # 阶段耗时只显示阶段名，其他指标带上指标名
+                    if name != 'bilibili_stage_seconds':
+                        label_text = f"{name.replace('bilibili_', '')} {label_text}".strip()
+                    lines.append(
+                        f'{label_text}: p50 {percentile(samples, 50) / scale:.2f}{unit} '
+                        f'p95 {percentile(samples, 95) / scale:.2f}{unit} (n={histogram.count})'
+                    )
+            for name, series in sorted(self._counters.items()):
+                short_name = name.replace('bilibili_', '').replace('_total', '')
+                for labels, value in sorted(series.items()):
+                    label_text = ','.join(f'{key}={label_value}' for key, label_value in labels)
+                    if short_name.endswith('bytes'):
+                        lines.append(f'{short_name}[{label_text}]: {value / 1024 / 1024:.1f}MB')
+                    else:
+                        lines.append(f'{short_name}[{label_text}]: {value:g}')
+        return '\n'.join(lines) or '暂无统计数据'
+
+metrics = Metrics(window=plugin_config.bilibili_metrics_window, log=plugin_config.bilibili_metrics_log)
@@ -0,0 +1,108 @@
+import asyncio
+import time
+import httpx
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from nonebot.log import logger
+from .config import Config
+from .http_client import get_client
+
+plugin_config = Config()
+
+# 新测得的吞吐量在评分中的权重
+SCORE_ALPHA = 0.3
+
+class HostScores:
+    """
+    各CDN节点的吞吐量评分（字节/秒，指数滑动平均），探测和实际下载都会更新
+    """
+
+    def __init__(self):
+        self._scores: Dict[str, float] = {}
+
+    def record(self, host: str, size: int, elapsed: float):
+        if size <= 0 or elapsed <= 0:
+            return
+        speed = size / elapsed
+        previous = self._scores.get(host)
+        self._scores[host] = speed if previous is None else previous * (1 - SCORE_ALPHA) + speed * SCORE_ALPHA
+
+    def penalize(self, host: str):
+        """探测失败或下载卡顿的节点评分减半"""
+        if host in self._scores:
+            self._scores[host] /= 2
+        else:
+            self._scores[host] = 0.0
+
+    def get(self, host: str) -> Optional[float]:
+        return self._scores.get(host)
+
+    def snapshot(self) -> Dict[str, float]:
+        return dict(self._scores)
+
+host_scores = HostScores()
+
+def url_host(url: str) -> str:
+    return urlparse(url).hostname or ''
+
+def candidate_urls(media_item: dict) -> List[str]:
+    """
+    DASH流的全部可用链接，与原来一样 backupUrl 在前、baseUrl 在后，去重
+    """
+    urls = []
+    for url in list(media_item.get('backupUrl') or media_item.get('backup_url') or []) + \
+               [media_item.get('baseUrl') or media_item.get('base_url')]:
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+def rank_by_score(urls: List[str]) -> List[str]:
+    """
+    按节点历史评分排序，未测过的节点排在已知节点之后、保持原顺序
+    """
+    def key(indexed):
+        index, url = indexed
+        score = host_scores.get(url_host(url))
+        return (score is None, -(score or 0), index)
+    return [url for _, url in sorted(enumerate(urls), key=key)]
+
+async def probe_mirror(url: str, headers: dict) -> Optional[float]:
+    """
+    用小范围Range请求测速，返回字节/秒，失败返回None
+    """
+    size = plugin_config.bilibili_mirror_probe_bytes
+    probe_headers = dict(headers, Range=f'bytes=0-{size - 1}')
+    start = time.monotonic()
+    received = 0
+    try:
+        async with get_client(url).stream('GET', url, headers=probe_headers,
+                                          timeout=plugin_config.bilibili_mirror_probe_timeout) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                if received >= size:
+                    break
+    except httpx.HTTPError:
+        return None
+    elapsed = time.monotonic() - start
+    host_scores.record(url_host(url), received, elapsed)
+    return received / elapsed if elapsed > 0 else None
+
+async def pick_mirrors(urls: List[str], headers: dict) -> List[str]:
+    """
+    同时探测所有镜像，结合历史评分从快到慢排序；探测失败的节点排在最后
+    只有一个链接或关闭探测时只按历史评分排序
+    """
+    if len(urls) <= 1 or not plugin_config.bilibili_mirror_probe:
+        return rank_by_score(urls)
+
+    results = await asyncio.gather(*(probe_mirror(url, headers) for url in urls))
+    for url, speed in zip(urls, results):
+        if speed is None:
+            host_scores.penalize(url_host(url))
+    ranked = rank_by_score(urls)
+    fastest = ranked[0]
+    score = host_scores.get(url_host(fastest))
+    if score:
+        logger.debug(f'选择镜像 {url_host(fastest)}，{score / 1024 / 1024:.2f}MB/s')
+    return ranked
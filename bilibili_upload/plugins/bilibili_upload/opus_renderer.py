@@ -0,0 +1,323 @@
+import asyncio
+import hashlib
+import io
+import os
+import httpx
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from nonebot.log import logger
+from .config import Config
+from .http_client import DEFAULT_HEADERS, get_client
+
+plugin_config = Config()
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# 常见系统中的中文字体，未配置 bilibili_opus_font 时依次查找
+FONT_CANDIDATES = [
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/usr/share/fonts/wenquanyi/wqy-microhei/wqy-microhei.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+    'C:/Windows/Fonts/msyh.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+    '/System/Library/Fonts/STHeiti Medium.ttc',
+]
+
+# 与网页截图一致的版面，单位为设备像素比1时的像素
+PAGE_WIDTH = 1200
+PADDING = 40
+AVATAR_SIZE = 80
+TEXT_COLOR = (24, 25, 28)
+GRAY_COLOR = (148, 153, 160)
+LINK_COLOR = (0, 138, 197)
+BACKGROUND = (255, 255, 255)
+# 正文中的@、话题、链接等节点用蓝色显示
+LINK_NODE_TYPES = ('RICH_TEXT_NODE_TYPE_AT', 'RICH_TEXT_NODE_TYPE_TOPIC', 'RICH_TEXT_NODE_TYPE_WEB',
+                   'RICH_TEXT_NODE_TYPE_BV', 'RICH_TEXT_NODE_TYPE_LOTTERY', 'RICH_TEXT_NODE_TYPE_VOTE')
+# 专栏文章在动态详情中只有截断的摘要和封面，正文需要打开文章页
+ARTICLE_DYNAMIC_TYPES = ('DYNAMIC_TYPE_ARTICLE',)
+ARTICLE_MAJOR_TYPES = ('MAJOR_TYPE_ARTICLE',)
+
+def find_font() -> Optional[str]:
+    configured = plugin_config.bilibili_opus_font
+    if configured:
+        return configured if os.path.exists(configured) else None
+    for path in FONT_CANDIDATES:
+        if os.path.exists(path):
+            return path
+    return None
+
+FONT_PATH = find_font() if PIL_AVAILABLE else None
+RENDERER_AVAILABLE = PIL_AVAILABLE and FONT_PATH is not None
+
+class OpusContent:
+    def __init__(self, author: Optional[str], avatar: Optional[str], pub_time: Optional[str],
+                 title: Optional[str], nodes: List[Tuple[str, bool]], pictures: List[str]):
+        self.author = author
+        self.avatar = avatar
+        self.pub_time = pub_time
+        self.title = title
+        # (文字, 是否为链接样式)
+        self.nodes = nodes
+        self.pictures = pictures
+
+def parse_opus_content(item: dict) -> Optional[OpusContent]:
+    """
+    从动态详情中取出作者、时间、标题、正文节点和图片；既没有正文也没有图片时返回None
+    同时兼容图文动态(opus)和旧版的 desc + draw 结构
+    专栏文章只有摘要和封面，返回None交给浏览器截图
+    """
+    modules = item.get('modules') or {}
+    author_module = modules.get('module_author') or {}
+    dynamic = modules.get('module_dynamic') or {}
+    major = dynamic.get('major') or {}
+    opus = major.get('opus') or {}
+
+    if item.get('type') in ARTICLE_DYNAMIC_TYPES or major.get('type') in ARTICLE_MAJOR_TYPES \
+            or '/read/cv' in (opus.get('jump_url') or ''):
+        return None
+
+    title = opus.get('title')
+    summary = opus.get('summary') or dynamic.get('desc') or {}
+    nodes = []
+    for node in summary.get('rich_text_nodes') or []:
+        text = node.get('text') or node.get('orig_text') or ''
+        if text:
+            nodes.append((text, node.get('type') in LINK_NODE_TYPES))
+    if not nodes and summary.get('text'):
+        nodes.append((summary['text'], False))
+
+    pictures = [pic.get('url') for pic in opus.get('pics') or [] if pic.get('url')]
+    if not pictures:
+        pictures = [pic.get('src') for pic in (major.get('draw') or {}).get('items') or [] if pic.get('src')]
+
+    if not nodes and not pictures:
+        return None
+    return OpusContent(
+        author=author_module.get('name'),
+        avatar=author_module.get('face'),
+        pub_time=author_module.get('pub_time'),
+        title=title,
+        nodes=nodes,
+        pictures=pictures,
+    )
+
+def _asset_dir() -> str:
+    return os.path.join(plugin_config.bilibili_download_dir, 'opus_assets')
+
+def _sized_url(url: str, width: int) -> str:
+    # B站图床支持按宽度缩放，不必下载原图
+    if url.startswith('//'):
+        url = 'https:' + url
+    if (urlparse(url).hostname or '').endswith('hdslb.com') and '@' not in url:
+        return f'{url}@{width}w.webp'
+    return url
+
+async def fetch_asset(url: str, width: int) -> Optional[bytes]:
+    """
+    下载图片并缓存在 opus_assets 下，同一图片同一宽度只下载一次
+    """
+    url = _sized_url(url, width)
+    path = os.path.join(_asset_dir(), hashlib.sha1(url.encode()).hexdigest())
+    if os.path.exists(path):
+        os.utime(path)
+        with open(path, 'rb') as f:
+            return f.read()
+    try:
+        response = await get_client(url).get(url, headers=DEFAULT_HEADERS, timeout=15)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.warning(f'专栏图片下载失败: {e}')
+        return None
+    os.makedirs(_asset_dir(), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(response.content)
+    os.replace(path + '.tmp', path)
+    return response.content
+
+async def fetch_assets(urls: List[str], width: int) -> Dict[str, Optional[bytes]]:
+    semaphore = asyncio.Semaphore(max(1, plugin_config.bilibili_opus_fetch_concurrency))
+
+    async def fetch(url: str):
+        async with semaphore:
+            return await fetch_asset(url, width)
+
+    unique = list(dict.fromkeys(urls))
+    results = await asyncio.gather(*(fetch(url) for url in unique))
+    return dict(zip(unique, results))
+
+def prune_assets(max_bytes: int):
+    """
+    图片缓存超过 max_bytes 时按最近使用时间删除
+    """
+    if not max_bytes or not os.path.isdir(_asset_dir()):
+        return
+    entries = sorted(
+        (entry for entry in os.scandir(_asset_dir()) if entry.is_file()),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def wrap_nodes(nodes: List[Tuple[str, bool]], font, max_width: int) -> List[List[Tuple[str, bool]]]:
+    """
+    按像素宽度逐字换行，中文没有空格也能正确折行；遇到换行符另起一行
+    """
+    lines = [[]]
+    line_width = 0.0
+    wrapped = False
+    for text, is_link in nodes:
+        run = ''
+        for char in text:
+            if char == '\n':
+                if run:
+                    lines[-1].append((run, is_link))
+                lines.append([])
+                run, line_width, wrapped = '', 0.0, False
+                continue
+            # 自动折行后行首的空格不显示
+            if char == ' ' and wrapped and line_width == 0:
+                continue
+            char_width = font.getlength(char)
+            if line_width + char_width > max_width and (run or lines[-1]):
+                if run:
+                    lines[-1].append((run, is_link))
+                lines.append([])
+                run, line_width, wrapped = '', 0.0, True
+                if char == ' ':
+                    continue
+            run += char
+            line_width += char_width
+        if run:
+            lines[-1].append((run, is_link))
+    return lines
+
+def _load_picture(data: Optional[bytes]):
+    if not data:
+        return None
+    try:
+        picture = Image.open(io.BytesIO(data))
+        picture.load()
+        return picture.convert('RGBA')
+    except Exception:
+        return None
+
+def render_content(content: OpusContent, assets: Dict[str, Optional[bytes]], output_path: str, scale: float):
+    """
+    在内存中排版并保存为PNG，之后与网页截图一样交给 postprocess_screenshot 压缩/切块
+    """
+    def px(value: float) -> int:
+        return int(round(value * scale))
+
+    width = px(PAGE_WIDTH)
+    padding = px(PADDING)
+    content_width = width - padding * 2
+    name_font = ImageFont.truetype(FONT_PATH, px(30))
+    time_font = ImageFont.truetype(FONT_PATH, px(22))
+    title_font = ImageFont.truetype(FONT_PATH, px(40))
+    text_font = ImageFont.truetype(FONT_PATH, px(30))
+    text_line = px(48)
+    title_line = px(60)
+
+    title_lines = wrap_nodes([(content.title, False)], title_font, content_width) if content.title else []
+    text_lines = wrap_nodes(content.nodes, text_font, content_width) if content.nodes else []
+
+    pictures = []
+    for url in content.pictures:
+        picture = _load_picture(assets.get(url))
+        if picture is None:
+            continue
+        if picture.width != content_width:
+            height = max(1, round(picture.height * content_width / picture.width))
+            picture = picture.resize((content_width, height), Image.LANCZOS)
+        pictures.append(picture)
+
+    header_height = px(AVATAR_SIZE)
+    height = padding + header_height + padding
+    height += len(title_lines) * title_line + (padding // 2 if title_lines else 0)
+    height += len(text_lines) * text_line + (padding // 2 if text_lines else 0)
+    height += sum(picture.height + padding // 2 for picture in pictures)
+    height += padding
+
+    canvas = Image.new('RGB', (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(canvas)
+
+    y = padding
+    avatar = _load_picture(assets.get(content.avatar)) if content.avatar else None
+    text_x = padding
+    if avatar is not None:
+        size = px(AVATAR_SIZE)
+        avatar = avatar.resize((size, size), Image.LANCZOS)
+        mask = Image.new('L', (size, size), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, size - 1, size - 1), fill=255)
+        canvas.paste(avatar, (padding, y), mask)
+        text_x = padding + size + px(20)
+    if content.author:
+        draw.text((text_x, y + px(6)), content.author, font=name_font, fill=TEXT_COLOR)
+    if content.pub_time:
+        draw.text((text_x, y + px(48)), content.pub_time, font=time_font, fill=GRAY_COLOR)
+    y += header_height + padding
+
+    for line in title_lines:
+        draw.text((padding, y), ''.join(text for text, _ in line), font=title_font, fill=TEXT_COLOR)
+        y += title_line
+    if title_lines:
+        y += padding // 2
+
+    for line in text_lines:
+        x = padding
+        for text, is_link in line:
+            draw.text((x, y), text, font=text_font, fill=LINK_COLOR if is_link else TEXT_COLOR)
+            x += text_font.getlength(text)
+        y += text_line
+    if text_lines:
+        y += padding // 2
+
+    for picture in pictures:
+        canvas.paste(picture, (padding, y), picture)
+        y += picture.height + padding // 2
+
+    # 中间文件，压缩交给后处理
+    canvas.save(output_path, 'PNG', compress_level=1)
+
+async def render_opus(item: dict, output_path: str) -> bool:
+    """
+    不启动浏览器，直接用动态详情接口的数据排版出图片；数据不足或出错时返回False，由浏览器截图兜底
+    """
+    if not RENDERER_AVAILABLE:
+        return False
+    content = parse_opus_content(item)
+    if content is None:
+        return False
+    scale = plugin_config.bilibili_opus_device_scale
+    content_width = int(round((PAGE_WIDTH - PADDING * 2) * scale))
+    avatar_width = int(round(AVATAR_SIZE * scale))
+    try:
+        pictures, avatars = await asyncio.gather(
+            fetch_assets(content.pictures, content_width),
+            fetch_assets([content.avatar] if content.avatar else [], avatar_width),
+        )
+        assets = {**pictures, **avatars}
+        # 正文图片全部下载失败时内容不完整，交给浏览器
+        if content.pictures and not any(assets.get(url) for url in content.pictures):
+            return False
+        await asyncio.to_thread(render_content, content, assets, output_path, scale)
+        await asyncio.to_thread(prune_assets, plugin_config.bilibili_opus_asset_cache_bytes)
+        return True
+    except Exception as e:
+        logger.warning(f'专栏直接渲染失败: {e}')
+        return False
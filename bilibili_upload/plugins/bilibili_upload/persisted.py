@@ -0,0 +1,87 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from nonebot.log import logger
+
+# 修改后距上次保存超过该秒数即写入文件
+SAVE_INTERVAL = 60
+
+class PersistedDict:
+    """
+    保存在JSON文件中的有序字典，首次访问时读取，超出 max_size 时丢弃最早的条目
+    修改后距上次保存超过 SAVE_INTERVAL 秒即写入文件，关闭时由调用方执行 save()
+    keep 用于读取时过滤条目（如已过期的），返回False的不载入
+    """
+
+    def __init__(self, path: str, max_size: int, label: str,
+                 keep: Optional[Callable[[Any], bool]] = None):
+        self.path = path
+        self.max_size = max_size
+        self.label = label
+        self.keep = keep
+        self._data: OrderedDict = OrderedDict()
+        self._loaded = False
+        self._dirty = False
+        self._last_save = time.time()
+
+    def _load(self):
+        self._loaded = True
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'{self.label}读取失败: {e}')
+            return
+        for key, value in entries.items():
+            if self.keep is None or self.keep(value):
+                self._data[key] = value
+        self._trim()
+
+    def _trim(self):
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def _changed(self):
+        self._dirty = True
+        if time.time() - self._last_save > SAVE_INTERVAL:
+            self.save()
+
+    def get(self, key: str) -> Any:
+        if not self._loaded:
+            self._load()
+        return self._data.get(key)
+
+    def move_to_end(self, key: str):
+        self._data.move_to_end(key)
+
+    def set(self, key: str, value: Any):
+        if not self._loaded:
+            self._load()
+        self._data[key] = value
+        self._data.move_to_end(key)
+        self._trim()
+        self._changed()
+
+    def pop(self, key: str) -> Any:
+        if not self._loaded:
+            self._load()
+        value = self._data.pop(key, None)
+        if value is not None:
+            self._changed()
+        return value
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(dict(self._data), f, ensure_ascii=False)
+            self._dirty = False
+            self._last_save = time.time()
+        except OSError as e:
+            logger.warning(f'{self.label}保存失败: {e}')
@@ -0,0 +1,127 @@
+import asyncio
+import os
+from typing import Callable, List, Optional
+from nonebot.log import logger
+from .config import Config
+from .http_client import get_client
+from .transcode import spawn_ffmpeg, wait_ffmpeg
+
+plugin_config = Config()
+
+# pipe 模式通过继承的管道描述符把数据交给ffmpeg，仅支持POSIX系统
+PIPE_AVAILABLE = os.name == 'posix'
+
+ProgressCallback = Callable[[str, int, Optional[int]], None]
+
+def pipeline_mode() -> str:
+    """
+    off  - 先下载到临时文件再合并
+    pipe - 边下载边通过管道喂给ffmpeg，不落临时文件
+    http - ffmpeg 直接带请求头从CDN读取
+    pipe 在不支持的系统上退回 http
+    """
+    mode = plugin_config.bilibili_pipeline_mode
+    if mode == 'pipe' and not PIPE_AVAILABLE:
+        return 'http'
+    return mode
+
+async def _feed_pipe(url: str, fd: int, headers: dict, media_type: str,
+                     progress_callback: Optional[ProgressCallback]) -> int:
+    chunk_size = plugin_config.bilibili_download_chunk_size
+    downloaded = 0
+    with os.fdopen(fd, 'wb') as pipe:
+        async with get_client(url).stream('GET', url, headers=headers) as response:
+            response.raise_for_status()
+            total = response.headers.get('Content-Length')
+            total = int(total) if total and total.isdigit() else None
+            async for chunk in response.aiter_bytes(chunk_size):
+                if not chunk:
+                    continue
+                # 管道写满时会阻塞，放到线程中等待ffmpeg读取
+                await asyncio.to_thread(pipe.write, chunk)
+                downloaded += len(chunk)
+                if progress_callback:
+                    progress_callback(media_type, downloaded, total)
+    return downloaded
+
+async def _wait_process(process: asyncio.subprocess.Process, tasks: List[asyncio.Task],
+                        duration: Optional[float] = None,
+                        progress_callback: Optional[ProgressCallback] = None) -> bool:
+    # ffmpeg的进度输出要边下载边读取，否则stdout写满后ffmpeg会卡住
+    ffmpeg_task = asyncio.create_task(wait_ffmpeg(process, duration, progress_callback=progress_callback))
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        ffmpeg_task.cancel()
+        await asyncio.gather(ffmpeg_task, return_exceptions=True)
+        raise
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        # 任意一路下载失败时输出不完整，直接结束ffmpeg
+        ffmpeg_task.cancel()
+        await asyncio.gather(ffmpeg_task, return_exceptions=True)
+        logger.warning(f'管道下载失败: {errors[0]}')
+        return False
+    return await ffmpeg_task
+
+async def pipe_merge(video_url: str, audio_url: str, headers: dict, output_path: str,
+                     codec_args: List[str],
+                     progress_callback: Optional[ProgressCallback] = None,
+                     duration: Optional[float] = None) -> bool:
+    """
+    ffmpeg 先启动，音视频流边下载边写入管道 pipe:3 / pipe:4，下载和合并同时进行
+    """
+    video_read, video_write = os.pipe()
+    audio_read, audio_write = os.pipe()
+    try:
+        process = await spawn_ffmpeg([
+            '-i', f'pipe:{video_read}',
+            '-i', f'pipe:{audio_read}',
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+            *codec_args,
+            '-movflags', '+faststart',
+            '-y',
+            output_path,
+        ], pass_fds=(video_read, audio_read))
+    except Exception:
+        for fd in (video_write, audio_write):
+            os.close(fd)
+        raise
+    finally:
+        # 读端已交给ffmpeg，本进程不再持有，ffmpeg退出后写入会立即报错而不是卡住
+        for fd in (video_read, audio_read):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    tasks = [
+        asyncio.create_task(_feed_pipe(video_url, video_write, headers, 'video', progress_callback)),
+        asyncio.create_task(_feed_pipe(audio_url, audio_write, headers, 'audio', progress_callback)),
+    ]
+    return await _wait_process(process, tasks, duration, progress_callback)
+
+async def http_merge(video_url: str, audio_url: str, headers: dict, output_path: str,
+                     codec_args: List[str],
+                     progress_callback: Optional[ProgressCallback] = None,
+                     duration: Optional[float] = None) -> bool:
+    """
+    ffmpeg 直接从CDN读取两路流，带上B站要求的 Referer / User-Agent
+    """
+    header_lines = ''.join(f'{key}: {value}\r\n' for key, value in headers.items())
+    input_args = ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+                  '-headers', header_lines]
+    process = await spawn_ffmpeg([
+        *input_args, '-i', video_url,
+        *input_args, '-i', audio_url,
+        '-map', '0:v:0',
+        '-map', '1:a:0',
+        *codec_args,
+        '-movflags', '+faststart',
+        '-y',
+        output_path,
+    ])
+    return await wait_ffmpeg(process, duration, progress_callback=progress_callback)
@@ -0,0 +1,187 @@
+import asyncio
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+from .config import Config
+from .metrics import metrics
+
+plugin_config = Config()
+
+class JobRejected(Exception):
+    """任务因队列已满或超过群/用户上限被拒绝，异常信息可直接回复给用户"""
+
+class Job:
+    def __init__(self, func: Callable[..., Awaitable], args: tuple, group_id: Optional[int], user_id: Optional[int]):
+        self.func = func
+        self.args = args
+        self.group_id = group_id
+        self.user_id = user_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.submitted_at = time.monotonic()
+        # 任务调用 release_worker() 后置位，工作协程不再等待它
+        self.released = asyncio.Event()
+        # 让出工作协程后占用一个合并名额，任务结束时归还
+        self.holds_slot = False
+
+_current_job: ContextVar[Optional[Job]] = ContextVar('bilibili_current_job', default=None)
+
+def release_worker():
+    """
+    网络阶段结束时由任务调用：有空闲的合并名额时工作协程转去处理下一个任务，本任务继续运行（如ffmpeg合并）直到完成
+    群/用户的任务计数在任务真正结束时才释放；不在调度器中运行时什么也不做
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.released.set()
+
+class JobScheduler:
+    """
+    有界任务队列 + 固定数量的工作协程，任务为协程函数，在独立的Task中执行
+    工作协程只在任务的网络阶段占用，任务调用 release_worker() 后即可处理下一个；
+    已让出的任务最多 max_released 个，名额用完时工作协程继续等待，直到有任务结束
+    """
+
+    def __init__(self, max_queue: int, workers: int,
+                 group_limit: int = 0, user_limit: int = 0, max_released: int = 0):
+        self.max_queue = max_queue
+        self.workers = workers
+        self.group_limit = group_limit
+        self.user_limit = user_limit
+        self.max_released = max_released
+        self._queue: Optional[asyncio.Queue] = None
+        self._released_slots: Optional[asyncio.Semaphore] = None
+        self._tasks = []
+        self._jobs: Set[asyncio.Future] = set()
+        self._running = 0
+        self._released = 0
+        self._group_jobs: Dict[int, int] = defaultdict(int)
+        self._user_jobs: Dict[int, int] = defaultdict(int)
+
+    def _ensure_started(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._released_slots = asyncio.Semaphore(self.max_released)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def submit(self, func: Callable[..., Awaitable], *args,
+               group_id: Optional[int] = None, user_id: Optional[int] = None) -> Tuple[asyncio.Future, int]:
+        """
+        提交任务，返回 (结果future, 排队位置)，排队位置为0表示有空闲工作协程可立即开始
+        队列已满或超出群/用户上限时抛出 JobRejected
+        """
+        self._ensure_started()
+        if group_id is not None and self.group_limit and self._group_jobs[group_id] >= self.group_limit:
+            raise JobRejected(f"本群已有{self._group_jobs[group_id]}个任务在处理，请稍后再试")
+        if user_id is not None and self.user_limit and self._user_jobs[user_id] >= self.user_limit:
+            raise JobRejected(f"你已有{self._user_jobs[user_id]}个任务在处理，请稍后再试")
+
+        job = Job(func, args, group_id, user_id)
+        # 空闲的工作协程会立即取走任务，只有全部忙碌时才需要排队；已让出、等待合并的任务也排在前面
+        position = max(0, self._queue.qsize() + self._running - self.workers + 1)
+        if position:
+            position += self._released
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobRejected("当前任务过多，队列已满，请稍后再试")
+
+        if group_id is not None:
+            self._group_jobs[group_id] += 1
+        if user_id is not None:
+            self._user_jobs[user_id] += 1
+        return job.future, position
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._running += 1
+            metrics.observe('bilibili_queue_wait_seconds', time.monotonic() - job.submitted_at)
+            # 新建的Task复制当前上下文，任务内的 release_worker() 能找到自己的 Job
+            token = _current_job.set(job)
+            task = asyncio.ensure_future(job.func(*job.args))
+            _current_job.reset(token)
+            self._jobs.add(task)
+            task.add_done_callback(lambda done, job=job: self._finish(job, done))
+            released = asyncio.ensure_future(job.released.wait())
+            slot = None
+            try:
+                await asyncio.wait({task, released}, return_when=asyncio.FIRST_COMPLETED)
+                if not task.done():
+                    # 合并名额用完时继续占用工作协程，直到拿到名额或任务结束
+                    slot = asyncio.ensure_future(self._released_slots.acquire())
+                    await asyncio.wait({task, slot}, return_when=asyncio.FIRST_COMPLETED)
+                    if slot.done() and not slot.cancelled():
+                        if task.done():
+                            self._released_slots.release()
+                        else:
+                            job.holds_slot = True
+                            self._released += 1
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            finally:
+                released.cancel()
+                if slot is not None and not slot.done():
+                    slot.cancel()
+                self._running -= 1
+
+    def _finish(self, job: Job, task: asyncio.Future):
+        self._jobs.discard(task)
+        if not job.future.done():
+            if task.cancelled():
+                job.future.cancel()
+            elif task.exception() is not None:
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+        self._release(job)
+        if job.holds_slot:
+            job.holds_slot = False
+            self._released -= 1
+            if self._released_slots is not None:
+                self._released_slots.release()
+        if self._queue is not None:
+            self._queue.task_done()
+
+    def _release(self, job: Job):
+        if job.group_id is not None:
+            self._group_jobs[job.group_id] -= 1
+            if self._group_jobs[job.group_id] <= 0:
+                del self._group_jobs[job.group_id]
+        if job.user_id is not None:
+            self._user_jobs[job.user_id] -= 1
+            if self._user_jobs[job.user_id] <= 0:
+                del self._user_jobs[job.user_id]
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 已释放工作协程、仍在合并阶段的任务
+        for task in list(self._jobs):
+            task.cancel()
+        await asyncio.gather(*self._jobs, return_exceptions=True)
+        self._jobs.clear()
+        if self._queue is not None:
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                if not job.future.done():
+                    job.future.cancel()
+        self._queue = None
+        self._released_slots = None
+        self._released = 0
+
+video_scheduler = JobScheduler(
+    max_queue=plugin_config.bilibili_queue_size,
+    workers=plugin_config.bilibili_network_workers,
+    group_limit=plugin_config.bilibili_group_job_limit,
+    user_limit=plugin_config.bilibili_user_job_limit,
+    max_released=plugin_config.bilibili_merge_backlog,
+)
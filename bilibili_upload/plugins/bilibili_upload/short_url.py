@@ -0,0 +1,94 @@
+import os
+import time
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+from .config import Config
+from .http_client import get_client
+from .persisted import PersistedDict
+from .singleflight import SingleFlight
+
+plugin_config = Config()
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 Edg/91.0.864.67',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'zh-CN,zh;q=0.8,zh-TW;q=0.7,zh-HK;q=0.5,en-US;q=0.3,en;q=0.2',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+def canonicalize_video_url(url: str) -> str:
+    """
+    去掉分享链接中的追踪参数，只保留BV号和分P参数
+    """
+    parsed = urlparse(url)
+    if 'bilibili.com' not in (parsed.hostname or '') or '/video/' not in parsed.path:
+        return url
+    video_id = parsed.path.split('/video/', 1)[1].strip('/').split('/')[0]
+    page = parse_qs(parsed.query).get('p', [None])[0]
+    canonical = f"https://www.bilibili.com/video/{video_id}"
+    if page and page != '1':
+        canonical += f"?p={page}"
+    return canonical
+
+async def fetch_short_url(url: str) -> str:
+    client = get_client(url)
+    try:
+        response = await client.head(url, headers=HEADERS)
+        return str(response.url)
+    except Exception:
+        try:
+            async with client.stream('GET', url, headers=HEADERS) as response:
+                return str(response.url)
+        except Exception:
+            return url
+
+class ShortUrlResolver:
+    """
+    b23.tv 短链解析，带内存LRU+TTL缓存
+    同一短链的并发解析只发一次请求；缓存定期及关闭时写入文件，重启后继续使用
+    解析失败（返回原链接）的结果不缓存
+    """
+
+    def __init__(self, cache_path: str, max_size: int, ttl: int):
+        self.ttl = ttl
+        # 值为 (解析结果, 过期时间)，读取时跳过已过期的
+        self._cache = PersistedDict(cache_path, max_size, '短链缓存',
+                                    keep=lambda entry: entry[1] > time.time())
+        self._flight = SingleFlight()
+
+    def get(self, url: str) -> Optional[str]:
+        entry = self._cache.get(url)
+        if entry is None:
+            return None
+        resolved, expires_at = entry
+        if expires_at <= time.time():
+            self._cache.pop(url)
+            return None
+        self._cache.move_to_end(url)
+        return resolved
+
+    def put(self, url: str, resolved: str):
+        self._cache.set(url, (resolved, time.time() + self.ttl))
+
+    async def resolve(self, url: str) -> str:
+        cached = self.get(url)
+        if cached:
+            return cached
+
+        async def _fetch():
+            resolved = await fetch_short_url(url)
+            if resolved != url:
+                resolved = canonicalize_video_url(resolved)
+                self.put(url, resolved)
+            return resolved
+
+        return await self._flight.do(url, _fetch)
+
+    def save(self):
+        self._cache.save()
+
+short_url_resolver = ShortUrlResolver(
+    os.path.join(plugin_config.bilibili_download_dir, 'short_urls.json'),
+    max_size=plugin_config.bilibili_short_url_cache_size,
+    ttl=plugin_config.bilibili_short_url_ttl,
+)
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple, Union
+
+class SingleFlight:
+    """
+    同一个key同时只执行一次，期间的重复请求共享同一个结果
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    def join(self, key: str,
+             start: Callable[[], Union[Awaitable, asyncio.Future]]) -> Tuple[asyncio.Future, bool]:
+        """
+        已有同key任务时返回它的future，否则调用start()开始新任务
+        返回 (future, 是否由本次调用发起)，start()抛出的异常直接向上传递
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            return future, False
+
+        future = asyncio.ensure_future(start())
+        self._inflight[key] = future
+
+        def _done(f: asyncio.Future):
+            if self._inflight.get(key) is f:
+                del self._inflight[key]
+            # 没有等待者时也要取走异常，避免 "exception was never retrieved"
+            if not f.cancelled():
+                f.exception()
+
+        future.add_done_callback(_done)
+        return future, True
+
+    async def do(self, key: str, start: Callable[[], Union[Awaitable, asyncio.Future]]) -> Any:
+        future, _ = self.join(key, start)
+        # shield: 某个等待者被取消时不影响共享的任务
+        return await asyncio.shield(future)
+
+video_flight = SingleFlight()
+opus_flight = SingleFlight()
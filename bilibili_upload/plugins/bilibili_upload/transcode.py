@@ -0,0 +1,125 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import time
+from typing import Callable, List, Optional, Sequence
+from nonebot.log import logger
+from .config import Config
+
+plugin_config = Config()
+
+ProgressCallback = Callable[[str, int, Optional[int]], None]
+
+# 转码预设：preset 越慢压缩率越高，crf 越大体积越小、画质越低
+TRANSCODE_PROFILES = {
+    'fast': {'preset': 'veryfast', 'crf': 23},
+    'balanced': {'preset': 'medium', 'crf': 23},
+    'small': {'preset': 'slow', 'crf': 28},
+}
+TRANSCODE_AUDIO_BITRATE = 128 * 1000
+# 运行超过该秒数的ffmpeg才在日志中输出进度
+PROGRESS_LOG_AFTER = 5.0
+
+def transcode_profile() -> dict:
+    name = plugin_config.bilibili_transcode_profile
+    if name not in TRANSCODE_PROFILES:
+        logger.warning(f'未知的转码预设 {name}，使用 balanced')
+        name = 'balanced'
+    return TRANSCODE_PROFILES[name]
+
+def transcode_args(video_bitrate: Optional[int] = None) -> List[str]:
+    """
+    libx264/AAC 转码参数；指定 video_bitrate 时按目标码率转码，否则按预设的CRF
+    """
+    profile = transcode_profile()
+    args = ['-c:v', 'libx264', '-preset', profile['preset']]
+    if video_bitrate:
+        args += [
+            '-b:v', str(video_bitrate),
+            '-maxrate', str(video_bitrate),
+            '-bufsize', str(video_bitrate * 2),
+        ]
+    else:
+        args += ['-crf', str(profile['crf'])]
+    if plugin_config.bilibili_ffmpeg_threads > 0:
+        args += ['-threads', str(plugin_config.bilibili_ffmpeg_threads)]
+    args += ['-c:a', 'aac', '-b:a', str(TRANSCODE_AUDIO_BITRATE)]
+    return args
+
+def priority_prefix() -> List[str]:
+    """
+    用 nice/ionice 降低ffmpeg的CPU和磁盘优先级，系统中没有对应命令时跳过
+    """
+    prefix = []
+    if os.name != 'posix':
+        return prefix
+    if plugin_config.bilibili_ffmpeg_ionice and shutil.which('ionice'):
+        # best-effort 类中的最低优先级
+        prefix += ['ionice', '-c', '2', '-n', '7']
+    if plugin_config.bilibili_ffmpeg_nice > 0 and shutil.which('nice'):
+        prefix += ['nice', '-n', str(plugin_config.bilibili_ffmpeg_nice)]
+    return prefix
+
+async def spawn_ffmpeg(args: Sequence[str], pass_fds: Sequence[int] = ()) -> asyncio.subprocess.Process:
+    """
+    启动ffmpeg，进度信息以 key=value 形式输出到 stdout，由 wait_ffmpeg 读取
+    """
+    try:
+        return await asyncio.create_subprocess_exec(
+            *priority_prefix(), 'ffmpeg',
+            '-nostats', '-progress', 'pipe:1',
+            *args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            pass_fds=tuple(pass_fds),
+        )
+    except FileNotFoundError:
+        raise Exception("未找到ffmpeg")
+
+async def _read_progress(process: asyncio.subprocess.Process, duration: Optional[float],
+                         progress_callback: Optional[ProgressCallback]):
+    total_ms = int(duration * 1000) if duration else None
+    started = time.monotonic()
+    last_logged = -1
+    async for raw in process.stdout:
+        key, _, value = raw.decode(errors='ignore').strip().partition('=')
+        # out_time_ms 实际单位是微秒，与 out_time_us 相同
+        if key not in ('out_time_us', 'out_time_ms') or not value.isdigit():
+            continue
+        done_ms = int(value) // 1000
+        if progress_callback:
+            progress_callback('merge', done_ms, total_ms)
+        if total_ms and time.monotonic() - started >= PROGRESS_LOG_AFTER:
+            percent = min(100, done_ms * 100 // total_ms)
+            if percent // 10 > last_logged:
+                last_logged = percent // 10
+                logger.debug(f'ffmpeg进度 {percent}%')
+
+async def wait_ffmpeg(process: asyncio.subprocess.Process, duration: Optional[float] = None,
+                      timeout: Optional[float] = None,
+                      progress_callback: Optional[ProgressCallback] = None) -> bool:
+    """
+    等待ffmpeg结束并解析进度；超时返回False，被取消时结束进程后继续抛出
+    timeout 为None时使用 bilibili_ffmpeg_timeout，0为不限制
+    """
+    timeout = plugin_config.bilibili_ffmpeg_timeout if timeout is None else timeout
+    reader = asyncio.create_task(_read_progress(process, duration, progress_callback))
+    try:
+        await asyncio.wait_for(asyncio.shield(reader), timeout or None)
+        return await process.wait() == 0
+    except asyncio.TimeoutError:
+        logger.warning(f'ffmpeg运行超过{timeout}秒，已终止')
+        return False
+    finally:
+        reader.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+async def run_ffmpeg(args: Sequence[str], duration: Optional[float] = None,
+                     timeout: Optional[float] = None,
+                     progress_callback: Optional[ProgressCallback] = None) -> bool:
+    process = await spawn_ffmpeg(args)
+    return await wait_ffmpeg(process, duration, timeout, progress_callback)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nonebot
+
+# 插件 __init__ 中注册了命令，导入前需要先初始化
+nonebot.init(driver='~none')
@@ -0,0 +1,43 @@
+"""
+视频链接解析：路径、查询参数中的分P不能被截断
+"""
+from bilibili_upload.plugins.bilibili_upload.classifier import LINK_OPUS, LINK_VIDEO, classify_links
+from bilibili_upload.plugins.bilibili_upload.utils import extract_bv_id, extract_page
+
+BV = 'BV1GJ411x7h7'
+
+
+def test_trailing_slash_page():
+    links = classify_links(f'快看 https://www.bilibili.com/video/{BV}/?p=3 好看')
+    assert [link.url for link in links] == [f'https://www.bilibili.com/video/{BV}/?p=3']
+    assert links[0].id == BV
+    assert extract_page(links[0].url) == 3
+
+
+def test_spm_query_page():
+    url = f'https://m.bilibili.com/video/{BV}?spm_id_from=333.788.videopod.episodes&p=2'
+    links = classify_links(f'{url}。')
+    assert [link.url for link in links] == [url]
+    assert extract_page(links[0].url) == 2
+    assert extract_bv_id(url) == BV
+
+
+def test_url_ends_at_cjk_and_brackets():
+    links = classify_links(f'（https://bilibili.com/video/{BV}?p=5），还有https://www.bilibili.com/video/{BV}?p=6.')
+    assert [link.url for link in links] == [
+        f'https://bilibili.com/video/{BV}?p=5',
+        f'https://www.bilibili.com/video/{BV}?p=6',
+    ]
+
+
+def test_opus_and_videos_in_order():
+    links = classify_links(f'https://www.bilibili.com/video/{BV}?p=4 和 https://www.bilibili.com/opus/123456')
+    assert [link.kind for link in links] == [LINK_VIDEO, LINK_OPUS]
+    assert links[1].id == '123456'
+
+
+def test_comma_and_semicolon_separated_links():
+    other = 'BV1xx411c7mD'
+    for sep in (',', ';', ''):
+        links = classify_links(f'https://www.bilibili.com/video/{BV}?p=2{sep}https://www.bilibili.com/video/{other}?p=3')
+        assert [(link.id, extract_page(link.url)) for link in links] == [(BV, 2), (other, 3)]